@@ -0,0 +1,152 @@
+"""Webhook certificate generation.
+
+Keys and certificates are generated in-process, without shelling out to
+``openssl`` or writing scratch files.
+"""
+
+from datetime import datetime, timedelta
+from ipaddress import IPv4Address
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+KEY_SIZE = 2048
+CA_VALIDITY = timedelta(days=3650)
+CERT_VALIDITY = timedelta(days=365)
+
+
+def _gen_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=KEY_SIZE)
+
+
+def _key_pem(key) -> str:
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode("utf-8")
+
+
+def _cert_pem(cert) -> str:
+    return cert.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+
+
+def _gen_ca(now):
+    ca_key = _gen_key()
+    ca_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    ca = (
+        x509.CertificateBuilder()
+        .subject_name(ca_name)
+        .issuer_name(ca_name)
+        .public_key(ca_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + CA_VALIDITY)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(ca_key.public_key()),
+            critical=False,
+        )
+        .sign(ca_key, hashes.SHA256())
+    )
+    return ca, ca_key
+
+
+def expiry(cert: str) -> datetime:
+    """Returns when the PEM encoded ``cert`` expires, in UTC."""
+
+    return x509.load_pem_x509_certificate(cert.encode("utf-8")).not_valid_after
+
+
+def gen_certs(model: str, app: str, ca: str = None, ca_key: str = None) -> dict:
+    """Generates a webhook server certificate signed by a CA.
+
+    The CA is generated along, unless the PEM encoded ``ca`` and ``ca_key`` to
+    sign with are given. Returns a dict with the PEM encoded server ``cert`` and
+    ``key``, the ``ca`` certificate and its ``ca_key``.
+    """
+
+    webhook = f"{app}-webhook-server-service"
+    now = datetime.utcnow()
+
+    if ca and ca_key:
+        ca = x509.load_pem_x509_certificate(ca.encode("utf-8"))
+        ca_key = serialization.load_pem_private_key(
+            ca_key.encode("utf-8"), password=None
+        )
+    else:
+        ca, ca_key = _gen_ca(now)
+
+    key = _gen_key()
+    suffixes = [
+        "",
+        f".{model}",
+        f".{model}.svc",
+        f".{model}.svc.cluster",
+        f".{model}.svc.cluster.local",
+    ]
+    names = [name + suffix for name in (app, webhook) for suffix in suffixes]
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(
+            x509.Name(
+                [
+                    x509.NameAttribute(NameOID.COUNTRY_NAME, "GB"),
+                    x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Canonical"),
+                    x509.NameAttribute(NameOID.LOCALITY_NAME, "Canonical"),
+                    x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Canonical"),
+                    x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, "Canonical"),
+                    x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1"),
+                ]
+            )
+        )
+        .issuer_name(ca.subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + CERT_VALIDITY)
+        .add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()),
+            critical=False,
+        )
+        .add_extension(
+            x509.BasicConstraints(ca=False, path_length=None), critical=False
+        )
+        .add_extension(
+            x509.KeyUsage(
+                digital_signature=True,
+                content_commitment=False,
+                key_encipherment=True,
+                data_encipherment=True,
+                key_agreement=False,
+                key_cert_sign=False,
+                crl_sign=False,
+                encipher_only=False,
+                decipher_only=False,
+            ),
+            critical=False,
+        )
+        .add_extension(
+            x509.ExtendedKeyUsage(
+                [ExtendedKeyUsageOID.SERVER_AUTH, ExtendedKeyUsageOID.CLIENT_AUTH]
+            ),
+            critical=False,
+        )
+        .add_extension(
+            x509.SubjectAlternativeName(
+                [x509.DNSName(name) for name in names]
+                + [x509.IPAddress(IPv4Address("127.0.0.1"))]
+            ),
+            critical=False,
+        )
+        .sign(ca_key, hashes.SHA256())
+    )
+
+    return {
+        "cert": _cert_pem(cert),
+        "key": _key_pem(key),
+        "ca": _cert_pem(ca),
+        "ca_key": _key_pem(ca_key),
+    }
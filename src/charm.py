@@ -1,21 +1,106 @@
 #!/usr/bin/env python3
 
+import json
 import logging
+import math
+import os
 from base64 import b64encode
-from glob import glob
-from pathlib import Path
-from subprocess import check_call
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from hashlib import sha256
+from time import time
 
-import yaml
-from ops.charm import CharmBase
+from lightkube import Client, codecs
+from lightkube.core.exceptions import ApiError
+from lightkube.resources.apps_v1 import DaemonSet, Deployment
+from lightkube.resources.core_v1 import ConfigMap, Pod, Secret
+from lightkube.types import PatchType
+from ops.charm import CharmBase, ConfigChangedEvent
 from ops.framework import StoredState
 from ops.main import main
 from ops.model import ActiveStatus, MaintenanceStatus
 
+import images
+import inference_config
+import metrics
+import prepull
+import webhooks
+from certs import expiry, gen_certs
+from crds import load_crds, serve_versions, strip_descriptions
 from oci_image import OCIImageResource, OCIImageResourceError
+from options import (
+    CheckFailed,
+    parse_go_memory,
+    parse_ip,
+    parse_labels,
+    parse_port,
+    parse_quantity,
+    parse_yaml,
+    quantity_value,
+)
+from timing import HookTimer
 
 log = logging.getLogger()
 
+ISVC_CRD = "inferenceservices.serving.kubeflow.org"
+CERT_KEYS = ("cert", "key", "ca")
+CERT_SECRET = "kfserving-webhook-server-cert"
+CERT_RENEWAL = timedelta(days=30)
+CONFIG_MAP = "inferenceservice-config"
+# Rollouts whose time to ready is kept
+ROLLOUT_HISTORY = 10
+# Inputs prepared concurrently: certificates, image, CRDs and config
+PREPARE_WORKERS = 4
+TOLERATION_FIELDS = {"key", "operator", "value", "effect", "tolerationSeconds"}
+TOLERATION_EFFECTS = ("", "NoSchedule", "PreferNoSchedule", "NoExecute")
+
+
+def placement_values(placement):
+    """Returns ``placement`` with quantities as numbers, to compare placements.
+
+    The API server normalizes the quantities it stores, e.g. 0.5 as 500m.
+    """
+
+    resources = {
+        kind: {name: quantity_value(str(q)) for name, q in quantities.items()}
+        for kind, quantities in placement["resources"].items()
+        if quantities
+    }
+    return {**placement, "resources": resources}
+
+
+def live_placement(deployment):
+    """Returns the placement of the manager in a live workload Deployment."""
+
+    spec = deployment.spec.template.spec
+    manager = next((c for c in spec.containers if c.name == "manager"), None)
+    resources = manager.resources.to_dict() if manager and manager.resources else {}
+    return placement_values(
+        {
+            "resources": resources,
+            "nodeSelector": spec.nodeSelector or {},
+            "tolerations": [t.to_dict() for t in spec.tolerations or []],
+        }
+    )
+
+
+def rollout_completed(deployment):
+    """Returns the timestamp the last rollout of ``deployment`` completed at.
+
+    The Deployment controller marks a complete rollout by giving the
+    Progressing condition the NewReplicaSetAvailable reason, and leaves the
+    condition alone until the next rollout starts.
+    """
+
+    for condition in deployment.status.conditions or []:
+        if (
+            condition.type == "Progressing"
+            and condition.reason == "NewReplicaSetAvailable"
+            and condition.lastUpdateTime is not None
+        ):
+            return condition.lastUpdateTime.timestamp()
+    return None
+
 
 class Operator(CharmBase):
     _stored = StoredState()
@@ -23,543 +108,1041 @@ class Operator(CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
+        self._stored.set_default(
+            cert=None,
+            key=None,
+            ca=None,
+            ca_key=None,
+            image_details=None,
+            spec_fingerprint=None,
+            hook_timings=None,
+            workload_patched=False,
+            prepull_fingerprint=None,
+            image_rewrites=None,
+            in_place_resources={},
+            verify_in_place=False,
+            rollout_started=None,
+            rollouts="[]",
+            spec_failed=False,
+        )
+        self.timer = HookTimer()
+        self.framework.observe(self.on.hook_timings_action, self.hook_timings)
+        self.framework.observe(self.on.image_rewrites_action, self.image_rewrites)
+        self.framework.observe(self.on.rollout_times_action, self.rollout_times)
+
         if not self.model.unit.is_leader():
             log.info("Not a leader, skipping set_pod_spec")
             self.model.unit.status = ActiveStatus()
             return
 
-        self._stored.set_default(**self.gen_certs())
+        self.ensure_certs()
+
         self.image = OCIImageResource(self, "oci-image")
         self.framework.observe(self.on.install, self.set_pod_spec)
         self.framework.observe(self.on.upgrade_charm, self.set_pod_spec)
         self.framework.observe(self.on.config_changed, self.set_pod_spec)
+        self.framework.observe(self.on.leader_elected, self.set_pod_spec)
+        self.framework.observe(self.on.replicas_relation_created, self.set_pod_spec)
+        self.framework.observe(self.on.replicas_relation_joined, self.set_pod_spec)
+        self.framework.observe(self.on.replicas_relation_departed, self.set_pod_spec)
+        self.framework.observe(
+            self.on.metrics_endpoint_relation_created, self.set_pod_spec
+        )
+        self.framework.observe(self.on.kfserving_relation_created, self.set_pod_spec)
+        self.framework.observe(self.on.update_status, self.update_status)
+        self.framework.observe(self.on.remove, self.remove)
 
     def set_pod_spec(self, event):
+        self.timer.start()
         try:
-            image_details = self.image.fetch()
-        except OCIImageResourceError as e:
+            self._set_pod_spec(event)
+            self._stored.spec_failed = False
+        except (CheckFailed, OCIImageResourceError) as e:
+            self._stored.spec_failed = True
             self.model.unit.status = e.status
             log.info(e)
-            return
+        finally:
+            self._stored.hook_timings = json.dumps(self.timer.report(event.handle.kind))
 
-        crds = [
-            {"name": crd["metadata"]["name"], "spec": crd["spec"]}
-            for crd in yaml.safe_load_all(Path("src/crds.yaml").read_text())
-        ]
-        cert = b64encode(self._stored.cert.encode("utf-8")).decode("utf-8")
-        crds[1]["spec"]["conversion"]["webhookClientConfig"]["caBundle"] = cert
+    def _set_pod_spec(self, event):
+        certs, image_details, crds, isvc_config = self.prepare_inputs(event)
+        if certs:
+            for key, value in certs.items():
+                setattr(self._stored, key, value)
+        self._stored.image_details = image_details
+        self.publish_certs()
 
-        mutating = [
-            {
-                "name": "inferenceservice.serving.kubeflow.org",
-                "webhooks": [
+        placement = self.workload_placement()
+
+        ca_bundle = b64encode(self._stored.ca.encode("utf-8")).decode("utf-8")
+        served_versions = webhooks.parse_served_versions(self.model.config)
+        serve_versions(
+            next(crd for crd in crds if crd["name"] == ISVC_CRD),
+            served_versions,
+            ca_bundle=ca_bundle,
+            namespace=self.model.name,
+        )
+
+        with self.timer.span("webhooks") as span:
+            mutating, validating = self.webhook_configurations(
+                ca_bundle, served_versions
+            )
+            span.measure([mutating, validating])
+
+        with self.timer.span("pod-spec") as span:
+            spec = self.pod_spec(image_details)
+            span.measure(spec)
+
+        with self.timer.span("config-map") as span:
+            self.configure_inference(isvc_config)
+            rewrites = self.rewrite_images(isvc_config)
+            config_map = inference_config.dump(isvc_config)
+            span.measure(config_map)
+        prepull_images = self.prepull_images(isvc_config)
+        if not prepull_images:
+            for helper in (prepull.BUSYBOX_IMAGE, prepull.PAUSE_IMAGE):
+                rewrites.pop(helper, None)
+
+        k8s_resources = {
+            "kubernetesResources": {
+                "customResourceDefinitions": crds,
+                "services": [
                     {
-                        "clientConfig": {
-                            "caBundle": cert,
-                            "service": {
-                                "name": "kfserving-webhook-server-service",
-                                "namespace": self.model.name,
-                                "path": "/mutate-serving-kubeflow-org-v1alpha2-inferenceservice",
-                            },
+                        "name": "kfserving-webhook-server-service",
+                        "spec": {
+                            "selector": {"app.kubernetes.io/name": "kfserving"},
+                            "ports": [
+                                {
+                                    "protocol": "TCP",
+                                    "port": 443,
+                                    "targetPort": parse_port(
+                                        self.model.config, "webhook-port"
+                                    ),
+                                }
+                            ],
                         },
-                        "failurePolicy": "Fail",
-                        "name": "inferenceservice.kfserving-webhook-server.defaulter",
-                        "rules": [
-                            {
-                                "apiGroups": ["serving.kubeflow.org"],
-                                "apiVersions": ["v1alpha2"],
-                                "operations": ["CREATE", "UPDATE"],
-                                "resources": ["inferenceservices"],
-                            }
-                        ],
                     },
+                    metrics.service(parse_port(self.model.config, "metrics-port")),
+                ],
+                "mutatingWebhookConfigurations": mutating,
+                "validatingWebhookConfigurations": validating,
+            },
+        }
+
+        payload = json.dumps([spec, k8s_resources], sort_keys=True)
+        fingerprint = sha256(payload.encode("utf-8")).hexdigest()
+        spec_changed = fingerprint != self._stored.spec_fingerprint
+        if not spec_changed:
+            log.info("Pod spec unchanged, skipping set_pod_spec")
+        else:
+            self.model.unit.status = MaintenanceStatus("Setting pod spec")
+            with self.timer.span("set-spec") as span:
+                self.model.pod.set_spec(spec, k8s_resources=k8s_resources)
+                span.measure(payload)
+            self._stored.spec_fingerprint = fingerprint
+            self._stored.rollout_started = time()
+            # Juju prunes the resources the previous spec owned once it applied
+            # this one, which happens after the hook, so look them up next time
+            self._stored.verify_in_place = True
+
+        self.publish_scrape_config()
+        self.publish_endpoints(isvc_config["ingress"])
+
+        with self.timer.span("in-place") as span:
+            in_place = [self.config_map(config_map), self.cert_secret()]
+            verify = self._stored.verify_in_place and not spec_changed
+            self.apply_in_place(in_place, verify=verify)
+            if verify:
+                self._stored.verify_in_place = False
+            span.measure(in_place)
+
+        if not spec_changed:
+            with self.timer.span("workload-patch"):
+                self.patch_workload(placement)
+        with self.timer.span("prepull"):
+            self.apply_prepull(prepull_images, rewrites)
+        if rewrites and json.dumps(rewrites) != self._stored.image_rewrites:
+            log.info(f"Rewrote images: {json.dumps(rewrites)}")
+        self._stored.image_rewrites = json.dumps(rewrites)
+        if not spec_changed:
+            self.check_webhook()
+
+    def update_status(self, event):
+        try:
+            # Until the config is fixed, keep the status telling what is wrong
+            if not self._stored.spec_failed:
+                self.patch_workload(self.workload_placement())
+            self.verify_in_place()
+            self.publish_scrape_config()
+            if self.renew_certs():
+                self.apply_in_place([self.cert_secret()])
+            if not self._stored.spec_failed:
+                self.check_webhook()
+        except CheckFailed as e:
+            self.model.unit.status = e.status
+            log.info(e)
+
+    def check_webhook(self):
+        """Sets the unit status from whether the webhook server answers.
+
+        The webhooks fail closed, so the unit stays in maintenance until the
+        server behind them is up. Until the manager Deployment has rolled out,
+        the server answering may be an old pod, so the server is only checked
+        once the rollout completed. Juju applies the pod spec after the hook
+        setting it, so that hook does not check and the status only catches up
+        on a later hook, usually update-status.
+
+        The time to ready of the last pod spec change is taken from when the
+        Deployment controller saw the rollout complete, which the readiness
+        probe on the webhook port holds back until the server answers, rather
+        than from when this check runs.
+        """
+
+        deployment = self.rolled_out_manager()
+        if deployment is None:
+            self.model.unit.status = MaintenanceStatus("Waiting for manager rollout")
+            return
+
+        host = f"{webhooks.SERVICE}.{self.model.name}.svc"
+        if not webhooks.ready(host, 443, self._stored.ca):
+            self.model.unit.status = MaintenanceStatus("Waiting for webhook server")
+            return
+
+        if self._stored.rollout_started is not None:
+            self.record_rollout(self._stored.rollout_started, deployment)
+            self._stored.rollout_started = None
+        self.model.unit.status = ActiveStatus()
+
+    def record_rollout(self, started, deployment):
+        """Records how long the manager took to roll out since ``started``.
+
+        A pod spec change that left the pod template alone rolls nothing, and
+        the last rollout then completed before it.
+        """
+
+        completed = rollout_completed(deployment)
+        if completed is None or completed < started:
+            log.info("Pod spec change did not roll the manager pods")
+            return
+
+        rollout = {"started": started, "seconds": round(completed - started, 3)}
+        rollouts = json.loads(self._stored.rollouts) + [rollout]
+        self._stored.rollouts = json.dumps(rollouts[-ROLLOUT_HISTORY:])
+        log.info(f"Manager rolled out and ready {rollout['seconds']}s after change")
+
+    def rolled_out_manager(self):
+        """Returns the manager Deployment once every pod runs the latest pod
+        template, else None.
+        """
+
+        try:
+            deployment = Client().get(
+                Deployment, self.model.app.name, namespace=self.model.name
+            )
+        except ApiError as e:
+            if e.status.code == 404:
+                return None
+            raise CheckFailed(f"Unable to get workload: {e.status.message}")
+
+        status = deployment.status
+        if status is None or status.observedGeneration is None:
+            return None
+        if status.observedGeneration < deployment.metadata.generation:
+            return None
+        if not (
+            (status.updatedReplicas or 0)
+            == (status.readyReplicas or 0)
+            == (status.replicas or 0)
+        ):
+            return None
+        return deployment
+
+    def webhook_configurations(self, ca_bundle, served_versions):
+        """Returns the mutating and validating webhook configurations."""
+
+        mutating, validating = webhooks.render(
+            ca_bundle, self.model.name, served_versions
+        )
+
+        config = self.model.config
+        overrides = parse_yaml(config, "webhook-overrides", dict, {})
+        namespace_labels = parse_labels(config, "webhook-namespace-selector")
+        webhooks.scope(
+            mutating + validating,
+            timeout=config["webhook-timeout"],
+            failure_policy=config["webhook-failure-policy"],
+            overrides=overrides,
+            namespace_labels=namespace_labels,
+        )
+
+        return mutating, validating
+
+    def pod_spec(self, image_details):
+        """Returns the pod spec of the manager, including its RBAC rules."""
+
+        return {
+            "version": 3,
+            "serviceAccount": {
+                "roles": [
                     {
-                        "clientConfig": {
-                            "caBundle": cert,
-                            "service": {
-                                "name": "kfserving-webhook-server-service",
-                                "namespace": self.model.name,
-                                "path": "/mutate-serving-kubeflow-org-v1beta1-inferenceservice",
-                            },
-                        },
-                        "failurePolicy": "Fail",
-                        "name": "inferenceservice.kfserving-webhook-server.v1beta1.defaulter",
+                        "global": True,
                         "rules": [
                             {
-                                "apiGroups": ["serving.kubeflow.org"],
-                                "apiVersions": ["v1beta1"],
-                                "operations": ["CREATE", "UPDATE"],
-                                "resources": ["inferenceservices"],
-                            }
-                        ],
-                    },
-                    {
-                        "clientConfig": {
-                            "caBundle": cert,
-                            "service": {
-                                "name": "kfserving-webhook-server-service",
-                                "namespace": self.model.name,
-                                "path": "/mutate-pods",
+                                "apiGroups": ["admissionregistration.k8s.io"],
+                                "resources": [
+                                    "mutatingwebhookconfigurations",
+                                    "validatingwebhookconfigurations",
+                                ],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
                             },
-                        },
-                        "failurePolicy": "Fail",
-                        "name": "inferenceservice.kfserving-webhook-server.pod-mutator",
-                        "namespaceSelector": {
-                            "matchExpressions": [
-                                {"key": "control-plane", "operator": "DoesNotExist"}
-                            ]
-                        },
-                        "objectSelector": {
-                            "matchExpressions": [
-                                {
-                                    "key": "serving.kubeflow.org/inferenceservice",
-                                    "operator": "Exists",
-                                }
-                            ]
-                        },
-                        "rules": [
                             {
                                 "apiGroups": [""],
-                                "apiVersions": ["v1"],
-                                "operations": ["CREATE", "UPDATE"],
-                                "resources": ["pods"],
-                            }
-                        ],
-                    },
-                ],
-            }
-        ]
-
-        validating = [
-            {
-                "name": "inferenceservice.serving.kubeflow.org",
-                "webhooks": [
-                    {
-                        "clientConfig": {
-                            "caBundle": cert,
-                            "service": {
-                                "name": "kfserving-webhook-server-service",
-                                "namespace": self.model.name,
-                                "path": "/validate-serving-kubeflow-org-v1alpha2-inferenceservice",
+                                "resources": ["configmaps"],
+                                "verbs": [
+                                    "create",
+                                    "get",
+                                    "list",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": [""],
+                                "resources": ["events"],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": [""],
+                                "resources": ["namespaces"],
+                                "verbs": ["get", "list", "watch"],
+                            },
+                            {
+                                "apiGroups": [""],
+                                "resources": ["secrets"],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": [""],
+                                "resources": ["serviceaccounts"],
+                                "verbs": ["get", "list", "watch"],
+                            },
+                            {
+                                "apiGroups": [""],
+                                "resources": ["services"],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": ["networking.istio.io"],
+                                "resources": ["virtualservices"],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": ["networking.istio.io"],
+                                "resources": ["virtualservices/finalizers"],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": ["networking.istio.io"],
+                                "resources": ["virtualservices/status"],
+                                "verbs": ["get", "patch", "update"],
+                            },
+                            {
+                                "apiGroups": ["serving.knative.dev"],
+                                "resources": ["services"],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": ["serving.knative.dev"],
+                                "resources": ["services/finalizers"],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
+                            },
+                            {
+                                "apiGroups": ["serving.knative.dev"],
+                                "resources": ["services/status"],
+                                "verbs": ["get", "patch", "update"],
                             },
-                        },
-                        "failurePolicy": "Fail",
-                        "name": "inferenceservice.kfserving-webhook-server.validator",
-                        "rules": [
                             {
                                 "apiGroups": ["serving.kubeflow.org"],
-                                "apiVersions": ["v1alpha2"],
-                                "operations": ["CREATE", "UPDATE"],
-                                "resources": ["inferenceservices"],
-                            }
-                        ],
-                    },
-                    {
-                        "clientConfig": {
-                            "caBundle": cert,
-                            "service": {
-                                "name": "kfserving-webhook-server-service",
-                                "namespace": self.model.name,
-                                "path": "/validate-serving-kubeflow-org-v1beta1-inferenceservice",
+                                "resources": [
+                                    "inferenceservices",
+                                    "inferenceservices/finalizers",
+                                ],
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
                             },
-                        },
-                        "failurePolicy": "Fail",
-                        "name": "inferenceservice.kfserving-webhook-server.v1beta1.validator",
-                        "rules": [
                             {
                                 "apiGroups": ["serving.kubeflow.org"],
-                                "apiVersions": ["v1beta1"],
-                                "operations": ["CREATE", "UPDATE"],
-                                "resources": ["inferenceservices"],
-                            }
-                        ],
-                    },
-                ],
-            },
-            {
-                "name": "trainedmodel.serving.kubeflow.org",
-                "webhooks": [
-                    {
-                        "clientConfig": {
-                            "caBundle": cert,
-                            "service": {
-                                "name": "kfserving-webhook-server-service",
-                                "namespace": self.model.name,
-                                "path": "/validate-serving-kubeflow-org-v1alpha1-trainedmodel",
+                                "resources": ["inferenceservices/status"],
+                                "verbs": ["get", "patch", "update"],
                             },
-                        },
-                        "failurePolicy": "Fail",
-                        "name": "trainedmodel.kfserving-webhook-server.validator",
-                        "rules": [
                             {
                                 "apiGroups": ["serving.kubeflow.org"],
-                                "apiVersions": ["v1alpha1"],
-                                "operations": ["CREATE", "UPDATE"],
                                 "resources": ["trainedmodels"],
-                            }
-                        ],
-                    }
-                ],
-            },
-        ]
-
-        self.model.unit.status = MaintenanceStatus("Setting pod spec")
-        self.model.pod.set_spec(
-            {
-                "version": 3,
-                "serviceAccount": {
-                    "roles": [
-                        {
-                            "global": True,
-                            "rules": [
-                                {
-                                    "apiGroups": ["admissionregistration.k8s.io"],
-                                    "resources": [
-                                        "mutatingwebhookconfigurations",
-                                        "validatingwebhookconfigurations",
-                                    ],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": [""],
-                                    "resources": ["configmaps"],
-                                    "verbs": [
-                                        "create",
-                                        "get",
-                                        "list",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": [""],
-                                    "resources": ["events"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": [""],
-                                    "resources": ["namespaces"],
-                                    "verbs": ["get", "list", "watch"],
-                                },
-                                {
-                                    "apiGroups": [""],
-                                    "resources": ["secrets"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": [""],
-                                    "resources": ["serviceaccounts"],
-                                    "verbs": ["get", "list", "watch"],
-                                },
-                                {
-                                    "apiGroups": [""],
-                                    "resources": ["services"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": ["networking.istio.io"],
-                                    "resources": ["virtualservices"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": ["networking.istio.io"],
-                                    "resources": ["virtualservices/finalizers"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": ["networking.istio.io"],
-                                    "resources": ["virtualservices/status"],
-                                    "verbs": ["get", "patch", "update"],
-                                },
-                                {
-                                    "apiGroups": ["serving.knative.dev"],
-                                    "resources": ["services"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": ["serving.knative.dev"],
-                                    "resources": ["services/finalizers"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": ["serving.knative.dev"],
-                                    "resources": ["services/status"],
-                                    "verbs": ["get", "patch", "update"],
-                                },
-                                {
-                                    "apiGroups": ["serving.kubeflow.org"],
-                                    "resources": [
-                                        "inferenceservices",
-                                        "inferenceservices/finalizers",
-                                    ],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": ["serving.kubeflow.org"],
-                                    "resources": ["inferenceservices/status"],
-                                    "verbs": ["get", "patch", "update"],
-                                },
-                                {
-                                    "apiGroups": ["serving.kubeflow.org"],
-                                    "resources": ["trainedmodels"],
-                                    "verbs": [
-                                        "create",
-                                        "delete",
-                                        "get",
-                                        "list",
-                                        "patch",
-                                        "update",
-                                        "watch",
-                                    ],
-                                },
-                                {
-                                    "apiGroups": ["serving.kubeflow.org"],
-                                    "resources": ["trainedmodels/status"],
-                                    "verbs": ["get", "patch", "update"],
-                                },
-                            ],
-                        }
-                    ]
-                },
-                "containers": [
-                    {
-                        "name": "manager",
-                        "command": ["/manager"],
-                        "args": ["--metrics-addr=127.0.0.1:8080"],
-                        "imageDetails": image_details,
-                        "ports": [
-                            {
-                                "name": "metrics",
-                                "containerPort": int(self.model.config["metrics-port"]),
+                                "verbs": [
+                                    "create",
+                                    "delete",
+                                    "get",
+                                    "list",
+                                    "patch",
+                                    "update",
+                                    "watch",
+                                ],
                             },
                             {
-                                "name": "webhook",
-                                "containerPort": int(self.model.config["webhook-port"]),
+                                "apiGroups": ["serving.kubeflow.org"],
+                                "resources": ["trainedmodels/status"],
+                                "verbs": ["get", "patch", "update"],
                             },
                         ],
-                        "envConfig": {"POD_NAMESPACE": self.model.name},
-                        "volumeConfig": [
-                            {
-                                "name": "certs",
-                                "mountPath": "/tmp/k8s-webhook-server/serving-certs",
-                                "files": [
-                                    {"path": "tls.crt", "content": self._stored.cert},
-                                    {"path": "tls.key", "content": self._stored.key},
-                                ],
-                            }
-                        ],
                     }
-                ],
+                ]
             },
-            k8s_resources={
-                "kubernetesResources": {
-                    "customResourceDefinitions": crds,
-                    "services": [
+            "containers": [
+                {
+                    "name": "manager",
+                    "command": ["/manager"],
+                    "args": self.manager_args(),
+                    "imageDetails": image_details,
+                    "ports": [
                         {
-                            "name": "kfserving-webhook-server-service",
-                            "spec": {
-                                "selector": {"app.kubernetes.io/name": "kfserving"},
-                                "ports": [
-                                    {
-                                        "protocol": "TCP",
-                                        "port": 443,
-                                        "targetPort": int(
-                                            self.model.config["webhook-port"]
-                                        ),
-                                    }
-                                ],
-                            },
+                            "name": "metrics",
+                            "containerPort": parse_port(
+                                self.model.config, "metrics-port"
+                            ),
+                        },
+                        {
+                            "name": "webhook",
+                            "containerPort": parse_port(
+                                self.model.config, "webhook-port"
+                            ),
+                        },
+                    ],
+                    "envConfig": self.manager_env(),
+                    "kubernetes": self.manager_probes(),
+                    "volumeConfig": [
+                        {
+                            "name": "certs",
+                            "mountPath": "/tmp/k8s-webhook-server/serving-certs",
+                            "secret": {"name": CERT_SECRET},
                         }
                     ],
-                    "mutatingWebhookConfigurations": mutating,
-                    "validatingWebhookConfigurations": validating,
-                },
-                "configMaps": {
-                    "inferenceservice-config": {
-                        Path(f).with_suffix("").name: Path(f).read_text()
-                        for f in glob("src/config/*.json")
-                    }
-                },
+                }
+            ],
+        }
+
+    def manager_probes(self):
+        """Returns the startup, readiness and liveness probes of the manager.
+
+        The webhook server only listens once its certificates and caches are
+        loaded, so its port gates readiness. The metrics endpoint doubles as a
+        health endpoint when it listens on the pod IP.
+        """
+
+        config = self.model.config
+        webhook = {"tcpSocket": {"port": parse_port(config, "webhook-port")}}
+        health = webhook
+        if parse_ip(config, "metrics-bind-address") in ("", "0.0.0.0", "::"):
+            port = parse_port(config, "metrics-port")
+            health = {"httpGet": {"path": "/metrics", "port": port}}
+        return {
+            "startupProbe": {**webhook, "periodSeconds": 2, "failureThreshold": 60},
+            "readinessProbe": {**webhook, "periodSeconds": 5, "failureThreshold": 3},
+            "livenessProbe": {
+                **health,
+                "periodSeconds": 20,
+                "timeoutSeconds": 5,
+                "failureThreshold": 3,
             },
-        )
-        self.model.unit.status = ActiveStatus()
+        }
+
+    def manager_args(self):
+        config = self.model.config
+        address = parse_ip(config, "metrics-bind-address")
+        if ":" in address:
+            address = f"[{address}]"
+        args = [f"--metrics-addr={address}:{parse_port(config, 'metrics-port')}"]
+        if config["leader-election"] or self.peer_units():
+            args.append("--enable-leader-election")
+        return args
+
+    def manager_env(self):
+        config = self.model.config
+        env = {"POD_NAMESPACE": self.model.name}
+
+        gomaxprocs = config["gomaxprocs"]
+        if gomaxprocs < 0:
+            raise CheckFailed(f"Invalid gomaxprocs: {gomaxprocs}")
+        cpu_limit = parse_quantity(config, "cpu-limit")
+        if not gomaxprocs and cpu_limit:
+            gomaxprocs = max(1, math.floor(quantity_value(cpu_limit)))
+        if gomaxprocs:
+            env["GOMAXPROCS"] = str(gomaxprocs)
+
+        gomemlimit = parse_go_memory(config, "gomemlimit")
+        if gomemlimit:
+            env["GOMEMLIMIT"] = gomemlimit
+        return env
+
+    def workload_placement(self):
+        """Returns the manager resources, nodeSelector and tolerations from config.
+
+        These are not part of the Juju pod spec, see ``patch_workload``.
+        """
+
+        config = self.model.config
+        resources = {"requests": {}, "limits": {}}
+        for resource in ("cpu", "memory"):
+            request = parse_quantity(config, f"{resource}-request")
+            limit = parse_quantity(config, f"{resource}-limit")
+            if request and limit and quantity_value(request) > quantity_value(limit):
+                raise CheckFailed(
+                    f"{resource}-request must not exceed {resource}-limit"
+                )
+            if request:
+                resources["requests"][resource] = request
+            if limit:
+                resources["limits"][resource] = limit
+
+        tolerations = parse_yaml(config, "tolerations", list, [])
+        for toleration in tolerations:
+            if (
+                not isinstance(toleration, dict)
+                or not set(toleration) <= TOLERATION_FIELDS
+                or toleration.get("operator", "Equal") not in ("Equal", "Exists")
+                or toleration.get("effect", "") not in TOLERATION_EFFECTS
+            ):
+                raise CheckFailed(f"Invalid tolerations: {toleration}")
+
+        return {
+            "resources": {k: v for k, v in resources.items() if v},
+            "nodeSelector": parse_labels(config, "node-selector"),
+            "tolerations": tolerations,
+        }
+
+    def patch_workload(self, placement):
+        """Patches the resources and scheduling constraints onto the manager pods.
+
+        Juju pod specs cannot express them, so they are patched onto the workload
+        Deployment. Any change to its pod template rolls the pods, so the live
+        template is only patched when it differs. Juju re-creates the template
+        after a hook that sets the pod spec, so that hook leaves the template
+        alone and update-status patches the re-created one.
+        """
 
-    def gen_certs(self):
-        model = self.model.name
-        app = self.model.app.name
-        webhook = f"{app}-webhook-server-service"
-        Path("/run/ssl.conf").write_text(
-            f"""[ req ]
-default_bits = 2048
-prompt = no
-default_md = sha256
-req_extensions = req_ext
-distinguished_name = dn
-[ dn ]
-C = GB
-ST = Canonical
-L = Canonical
-O = Canonical
-OU = Canonical
-CN = 127.0.0.1
-[ req_ext ]
-subjectAltName = @alt_names
-[ alt_names ]
-DNS.1 = {app}
-DNS.2 = {app}.{model}
-DNS.3 = {app}.{model}.svc
-DNS.4 = {app}.{model}.svc.cluster
-DNS.5 = {app}.{model}.svc.cluster.local
-DNS.6 = {webhook}
-DNS.7 = {webhook}.{model}
-DNS.8 = {webhook}.{model}.svc
-DNS.9 = {webhook}.{model}.svc.cluster
-DNS.10 = {webhook}.{model}.svc.cluster.local
-IP.1 = 127.0.0.1
-[ v3_ext ]
-authorityKeyIdentifier=keyid,issuer:always
-basicConstraints=CA:FALSE
-keyUsage=keyEncipherment,dataEncipherment,digitalSignature
-extendedKeyUsage=serverAuth,clientAuth
-subjectAltName=@alt_names"""
+        if not any(placement.values()) and not self._stored.workload_patched:
+            return
+
+        client = Client()
+        try:
+            deployment = client.get(
+                Deployment, self.model.app.name, namespace=self.model.name
+            )
+        except ApiError as e:
+            if e.status.code == 404:
+                log.info("Workload not created yet, patching it on a later hook")
+                return
+            raise CheckFailed(f"Unable to get workload: {e.status.message}")
+        if live_placement(deployment) == placement_values(placement):
+            self._stored.workload_patched = any(placement.values())
+            return
+
+        patch = {
+            "spec": {
+                "template": {
+                    "spec": {
+                        "containers": [
+                            {
+                                "name": "manager",
+                                "resources": placement["resources"] or None,
+                            }
+                        ],
+                        "nodeSelector": placement["nodeSelector"] or None,
+                        "tolerations": placement["tolerations"] or None,
+                    }
+                }
+            }
+        }
+        try:
+            client.patch(
+                Deployment, self.model.app.name, patch, namespace=self.model.name
+            )
+        except ApiError as e:
+            raise CheckFailed(f"Unable to patch workload: {e.status.message}")
+        log.info("Patched workload placement")
+        self._stored.workload_patched = any(placement.values())
+
+    def prepull_images(self, isvc_config):
+        """Returns the images to pre-pull on the nodes, if any."""
+
+        selected = self.model.config["prepull-runtimes"].split(",")
+        selected = [runtime.strip() for runtime in selected if runtime.strip()]
+        return prepull.images(isvc_config, selected) if selected else []
+
+    def apply_prepull(self, images, rewrites):
+        """Creates, updates or removes the image pre-pull DaemonSet."""
+
+        if not images:
+            if self._stored.prepull_fingerprint is not None:
+                self.remove_prepull()
+            return
+
+        manifest = prepull.daemonset(
+            name=f"{self.model.app.name}-prepull",
+            namespace=self.model.name,
+            images=images,
+            node_labels=parse_labels(self.model.config, "prepull-node-selector"),
+            busybox_image=rewrites.get(prepull.BUSYBOX_IMAGE, prepull.BUSYBOX_IMAGE),
+            pause_image=rewrites.get(prepull.PAUSE_IMAGE, prepull.PAUSE_IMAGE),
         )
+        fingerprint = sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+        if fingerprint == self._stored.prepull_fingerprint:
+            return
 
-        check_call(["openssl", "genrsa", "-out", "/run/ca.key", "2048"])
-        check_call(["openssl", "genrsa", "-out", "/run/server.key", "2048"])
-        check_call(
-            [
-                "openssl",
-                "req",
-                "-x509",
-                "-new",
-                "-sha256",
-                "-nodes",
-                "-days",
-                "3650",
-                "-key",
-                "/run/ca.key",
-                "-subj",
-                "/CN=127.0.0.1",
-                "-out",
-                "/run/ca.crt",
-            ]
+        name = manifest["metadata"]["name"]
+        client = Client()
+        try:
+            try:
+                client.create(codecs.from_dict(manifest))
+            except ApiError as e:
+                if e.status.code != 409:
+                    raise
+                client.patch(
+                    DaemonSet,
+                    name,
+                    manifest,
+                    namespace=self.model.name,
+                    patch_type=PatchType.MERGE,
+                )
+        except ApiError as e:
+            raise CheckFailed(f"Unable to apply {name}: {e.status.message}")
+        log.info(f"Applied {name} pre-pulling {', '.join(images)}")
+        self._stored.prepull_fingerprint = fingerprint
+
+    def remove_prepull(self):
+        name = f"{self.model.app.name}-prepull"
+        try:
+            Client().delete(DaemonSet, name, namespace=self.model.name)
+        except ApiError as e:
+            if e.status.code != 404:
+                raise CheckFailed(f"Unable to remove {name}: {e.status.message}")
+        self._stored.prepull_fingerprint = None
+
+    def remove(self, event):
+        # The remaining units still serve with the shared resources
+        if self.peer_units():
+            return
+
+        if self._stored.prepull_fingerprint is not None:
+            try:
+                self.remove_prepull()
+            except CheckFailed as e:
+                log.warning(e)
+        for resource, name in ((ConfigMap, CONFIG_MAP), (Secret, CERT_SECRET)):
+            try:
+                Client().delete(resource, name, namespace=self.model.name)
+            except ApiError as e:
+                if e.status.code != 404:
+                    log.warning(f"Unable to remove {name}: {e.status.message}")
+
+    def configure_inference(self, isvc_config):
+        """Adjusts the inferenceservice-config ConfigMap contents to the config."""
+
+        config = self.model.config
+        inference_config.set_ingress(isvc_config, config)
+        inference_config.set_sidecar_resources(
+            isvc_config,
+            profile=config["sidecar-profile"].strip(),
+            overrides=parse_yaml(config, "sidecar-resources", dict, {}),
         )
-        check_call(
-            [
-                "openssl",
-                "req",
-                "-new",
-                "-sha256",
-                "-key",
-                "/run/server.key",
-                "-out",
-                "/run/server.csr",
-                "-config",
-                "/run/ssl.conf",
-            ]
+        inference_config.set_logger_url(isvc_config, config["logger-url"].strip())
+        multi_model = config["multi-model-runtimes"].split(",")
+        inference_config.set_multi_model_serving(
+            isvc_config, [runtime.strip() for runtime in multi_model if runtime.strip()]
         )
-        check_call(
-            [
-                "openssl",
-                "x509",
-                "-req",
-                "-sha256",
-                "-in",
-                "/run/server.csr",
-                "-CA",
-                "/run/ca.crt",
-                "-CAkey",
-                "/run/ca.key",
-                "-CAcreateserial",
-                "-out",
-                "/run/cert.pem",
-                "-days",
-                "365",
-                "-extensions",
-                "v3_ext",
-                "-extfile",
-                "/run/ssl.conf",
-            ]
+        inference_config.apply_overlay(
+            isvc_config, parse_yaml(config, "config-overlay", dict, {})
+        )
+
+    def rewrite_images(self, isvc_config):
+        """Points the images of ``isvc_config`` at the mirror, pinning digests.
+
+        The pre-pull helper images are rewritten along, and all rewritten
+        images are returned keyed by the original ones.
+        """
+
+        return images.rewrite_config(
+            isvc_config,
+            mirror=images.parse_mirror(self.model.config),
+            digests=parse_yaml(self.model.config, "image-digests", dict, {}),
+            extra=(prepull.BUSYBOX_IMAGE, prepull.PAUSE_IMAGE),
         )
 
+    def config_map(self, data):
+        return {
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "metadata": {"name": CONFIG_MAP, "namespace": self.model.name},
+            "data": data,
+        }
+
+    def cert_secret(self):
         return {
-            "cert": Path("/run/cert.pem").read_text(),
-            "key": Path("/run/server.key").read_text(),
-            "ca": Path("/run/ca.crt").read_text(),
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "metadata": {"name": CERT_SECRET, "namespace": self.model.name},
+            "type": "kubernetes.io/tls",
+            "stringData": {"tls.crt": self._stored.cert, "tls.key": self._stored.key},
         }
 
+    def apply_in_place(self, resources, verify=False):
+        """Creates or updates resources the manager reloads without restarting.
+
+        The manager reads the inferenceservice-config ConfigMap as it reconciles,
+        and its webhook server watches the mounted certificate Secret, so they
+        are kept out of the pod spec, where any change restarts the manager.
+
+        Resources are skipped while unchanged since they were last applied. With
+        ``verify``, unchanged ones are looked up and created again if missing,
+        as when Juju pruned a copy an earlier pod spec owned.
+        """
+
+        client = Client()
+        for resource in resources:
+            name = resource["metadata"]["name"]
+            manifest = json.dumps(resource, sort_keys=True)
+            obj = codecs.from_dict(resource)
+            if self._stored.in_place_resources.get(name) == manifest:
+                if not verify or self.exists(client, type(obj), name):
+                    continue
+                log.info(f"{name} went missing, applying it again")
+
+            try:
+                try:
+                    client.create(obj)
+                except ApiError as e:
+                    if e.status.code != 409:
+                        raise
+                    client.patch(
+                        type(obj),
+                        name,
+                        resource,
+                        namespace=self.model.name,
+                        patch_type=PatchType.MERGE,
+                    )
+            except ApiError as e:
+                raise CheckFailed(f"Unable to apply {name}: {e.status.message}")
+            log.info(f"Applied {name} in place")
+            self._stored.in_place_resources[name] = manifest
+
+    def verify_in_place(self):
+        """Creates the resources applied in place again if they went missing."""
+
+        resources = self._stored.in_place_resources.values()
+        self.apply_in_place([json.loads(r) for r in resources], verify=True)
+        self._stored.verify_in_place = False
+
+    def exists(self, client, resource, name):
+        try:
+            client.get(resource, name, namespace=self.model.name)
+        except ApiError as e:
+            if e.status.code != 404:
+                raise CheckFailed(f"Unable to get {name}: {e.status.message}")
+            return False
+        return True
+
+    def publish_scrape_config(self):
+        """Points related Prometheus applications at the manager metrics.
+
+        Each manager pod is a target, so the pods are looked up again on
+        update-status, after a rollout replaced them.
+        """
+
+        relations = self.model.relations["metrics-endpoint"]
+        if not relations:
+            return
+
+        data = metrics.relation_data(
+            self.model,
+            model_uuid=os.environ.get("JUJU_MODEL_UUID", ""),
+            port=parse_port(self.model.config, "metrics-port"),
+            pods=self.manager_pods(),
+        )
+        for relation in relations:
+            if dict(relation.data[self.app]) != data:
+                relation.data[self.app].update(data)
+
+    def manager_pods(self):
+        """Returns the IPs of the running manager pods, keyed by pod name."""
+
+        try:
+            pods = Client().list(
+                Pod,
+                namespace=self.model.name,
+                labels={"app.kubernetes.io/name": self.model.app.name},
+            )
+            return {
+                pod.metadata.name: pod.status.podIP
+                for pod in pods
+                if pod.status and pod.status.podIP
+            }
+        except ApiError as e:
+            raise CheckFailed(f"Unable to list manager pods: {e.status.message}")
+
+    def publish_endpoints(self, ingress):
+        """Tells related clients which gateways serve InferenceServices.
+
+        The ``endpoint`` is the gateway service clients should call, the
+        cluster-local one if prefer-local-gateway is set, so that in-cluster
+        clients skip the external gateway.
+        """
+
+        prefer_local = self.model.config["prefer-local-gateway"]
+        data = {
+            "ingress-gateway": ingress["ingressGateway"],
+            "ingress-service": ingress["ingressService"],
+            "local-gateway": ingress["localGateway"],
+            "local-gateway-service": ingress["localGatewayService"],
+            "endpoint": ingress[
+                "localGatewayService" if prefer_local else "ingressService"
+            ],
+        }
+        for relation in self.model.relations["kfserving"]:
+            if dict(relation.data[self.app]) != data:
+                relation.data[self.app].update(data)
+
+    def peer_units(self):
+        """Returns the number of other units of this application."""
+
+        relation = self.model.get_relation("replicas")
+        return len(relation.units) if relation else 0
+
+    def ensure_certs(self):
+        """Adopts the certificates shared by a previous leader, if any.
+
+        Certificates are only generated once for the whole application, see
+        ``prepare_inputs``, so that leadership changes do not roll the manager
+        pods with new certificates.
+        """
+
+        relation = self.model.get_relation("replicas")
+        shared = relation.data[self.app] if relation else {}
+        if all(shared.get(key) for key in CERT_KEYS):
+            # Previous charm revisions did not share the CA key
+            for key in (*CERT_KEYS, "ca_key"):
+                setattr(self._stored, key, shared.get(key))
+
+    def renew_certs(self):
+        """Renews the server certificate before it expires, signed by the same CA.
+
+        Since the CA is unchanged, so are the CA bundles of the pod spec, and the
+        renewed certificate only has to reach the certificate Secret. Returns
+        whether the certificate was renewed.
+        """
+
+        if self._stored.ca_key is None:
+            return False
+        if expiry(self._stored.cert) - datetime.utcnow() > CERT_RENEWAL:
+            return False
+
+        certs = gen_certs(
+            model=self.model.name,
+            app=self.model.app.name,
+            ca=self._stored.ca,
+            ca_key=self._stored.ca_key,
+        )
+        self._stored.cert = certs["cert"]
+        self._stored.key = certs["key"]
+        self.publish_certs()
+        log.info(f"Renewed webhook certificate until {expiry(certs['cert'])}")
+        return True
+
+    def publish_certs(self):
+        """Shares the certificates with the units that may become leader later."""
+
+        relation = self.model.get_relation("replicas")
+        if relation is None:
+            return
+
+        certs = {key: getattr(self._stored, key) for key in (*CERT_KEYS, "ca_key")}
+        certs = {key: value for key, value in certs.items() if value is not None}
+        if any(relation.data[self.app].get(key) != certs[key] for key in certs):
+            relation.data[self.app].update(certs)
+
+    def hook_timings(self, event):
+        if self._stored.hook_timings is None:
+            event.fail("No hook timings recorded yet")
+            return
+
+        report = json.loads(self._stored.hook_timings)
+        results = {"hook": report["hook"], "seconds": report["seconds"]}
+        for span in report["spans"]:
+            for key in ("seconds", "bytes"):
+                if key in span:
+                    results[f"spans.{span['name']}.{key}"] = span[key]
+        event.set_results(results)
+
+    def image_rewrites(self, event):
+        if self._stored.image_rewrites is None:
+            event.fail("No images rewritten yet")
+            return
+
+        rewrites = json.loads(self._stored.image_rewrites)
+        event.set_results(
+            {
+                "count": len(rewrites),
+                "images": "\n".join(f"{old} -> {new}" for old, new in rewrites.items()),
+            }
+        )
+
+    def rollout_times(self, event):
+        rollouts = json.loads(self._stored.rollouts)
+        if not rollouts:
+            event.fail("No rollout became ready yet")
+            return
+
+        seconds = [rollout["seconds"] for rollout in rollouts]
+        event.set_results(
+            {
+                "count": len(rollouts),
+                "last": seconds[-1],
+                "max": max(seconds),
+                "rollouts": "\n".join(
+                    f"{datetime.utcfromtimestamp(rollout['started']).isoformat()}Z "
+                    f"{rollout['seconds']}s"
+                    for rollout in rollouts
+                ),
+            }
+        )
+
+    def prepare_inputs(self, event):
+        """Returns the certificates to generate, image details, CRDs and config.
+
+        These inputs are independent of each other and bound by I/O or by
+        native code, so they are prepared concurrently. Certificates are None
+        unless none were generated yet. Errors are raised as they would be if
+        the inputs were prepared one after the other. The workers only read the
+        stored state, the results are stored by the caller.
+        """
+
+        with self.timer.span("prepare"), ThreadPoolExecutor(PREPARE_WORKERS) as pool:
+            certs = None
+            if self._stored.cert is None:
+                certs = pool.submit(self.timed, "certs", self.generate_certs)
+            image_details = pool.submit(
+                self.timed, "image-fetch", self.fetch_image, event
+            )
+            crds = pool.submit(self.load_crds)
+            isvc_config = pool.submit(self.timed, "config-load", inference_config.load)
+            return (
+                certs and certs.result(),
+                image_details.result(),
+                crds.result(),
+                isvc_config.result(),
+            )
+
+    def timed(self, name, func, *args):
+        with self.timer.span(name):
+            return func(*args)
+
+    def generate_certs(self):
+        return gen_certs(model=self.model.name, app=self.model.app.name)
+
+    def load_crds(self):
+        with self.timer.span("crds") as span:
+            crds = load_crds()
+            span.measure(crds)
+        if self.model.config["strip-crd-descriptions"]:
+            before = span.bytes
+            with self.timer.span("crd-strip") as span:
+                for crd in crds:
+                    strip_descriptions(crd)
+                span.measure(crds)
+            log.info(f"Stripped CRD descriptions: {before} -> {span.bytes} bytes")
+        return crds
+
+    def fetch_image(self, event):
+        """Returns the OCI image details, reusing the last fetched ones if possible.
+
+        Attaching a new resource revision fires upgrade-charm, so the resource
+        only has to be fetched again on install and upgrade-charm.
+        """
+
+        if isinstance(event, ConfigChangedEvent) and self._stored.image_details:
+            return dict(self._stored.image_details)
+
+        return self.image.fetch()
+
 
 if __name__ == "__main__":
     main(Operator)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""CustomResourceDefinitions shipped with the charm.
+
+Parsing the ~15k lines of ``crds.yaml`` with the pure-Python YAML loader is the
+most expensive part of a hook, so the CRDs are also shipped pre-serialized as
+``crds.json``, tagged with the hash of the YAML they were generated from.
+Regenerate the bundle after touching ``crds.yaml`` with:
+
+    python src/crds.py
+"""
+
+import hashlib
+import json
+import logging
+import sys
+from pathlib import Path
+
+import yaml
+
+from options import CheckFailed
+
+log = logging.getLogger(__name__)
+
+CRDS_YAML = Path("src/crds.yaml")
+CRDS_BUNDLE = Path("src/crds.json")
+
+# Schema fields that only document, and play no part in validation
+DOC_FIELDS = ("description", "example", "externalDocs")
+# Schema fields holding a single subschema, a list of them, or a map of them
+SUBSCHEMA = ("additionalProperties", "items", "not")
+SUBSCHEMA_LISTS = ("allOf", "anyOf", "oneOf", "items")
+SUBSCHEMA_MAPS = ("properties", "patternProperties", "definitions")
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _parse_yaml(text: str) -> list:
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return [
+        {"name": crd["metadata"]["name"], "spec": crd["spec"]}
+        for crd in yaml.load_all(text, Loader=loader)
+    ]
+
+
+def build_bundle(source: Path = CRDS_YAML, target: Path = CRDS_BUNDLE) -> None:
+    """Serialize the CRDs in ``source`` to the compact ``target`` bundle."""
+
+    data = source.read_bytes()
+    bundle = {"sha256": _digest(data), "crds": _parse_yaml(data.decode("utf-8"))}
+    target.write_text(json.dumps(bundle, separators=(",", ":"), sort_keys=True))
+
+
+def load_crds(source: Path = CRDS_YAML, bundle: Path = CRDS_BUNDLE) -> list:
+    """Returns the CRDs as a list of ``{"name": ..., "spec": ...}`` dicts.
+
+    The pre-serialized bundle is used when it matches ``source``, otherwise the
+    YAML is parsed, with libyaml if it is available.
+    """
+
+    data = source.read_bytes()
+    try:
+        cached = json.loads(bundle.read_text())
+    except (OSError, ValueError) as e:
+        log.warning(f"Unable to read CRD bundle {bundle}, parsing {source}: {e}")
+    else:
+        if cached.get("sha256") == _digest(data):
+            return cached["crds"]
+        log.warning(f"CRD bundle {bundle} is stale, parsing {source}")
+
+    return _parse_yaml(data.decode("utf-8"))
+
+
+def serve_versions(crd: dict, versions: list, ca_bundle: str, namespace: str) -> None:
+    """Serves only ``versions`` of a multi-version CRD.
+
+    When several versions are served, objects are converted between them by the
+    controller's conversion webhook. A single version can only be served if it
+    is the storage version, as objects are stored in it and there is nothing
+    left to convert, so the conversion webhook is dropped. Serving another
+    version alone would relabel the stored objects without converting them.
+    The other versions stay listed but unserved.
+    """
+
+    spec = crd["spec"]
+    storage = next(v["name"] for v in spec["versions"] if v.get("storage"))
+    if len(versions) == 1 and versions[0] != storage:
+        raise CheckFailed(
+            f"Invalid served-api-versions: only the storage version {storage} "
+            "can be served alone"
+        )
+
+    spec["versions"].sort(key=lambda v: v["name"] not in versions)
+    for version in spec["versions"]:
+        version["served"] = version["name"] in versions
+    spec["version"] = spec["versions"][0]["name"]
+
+    if len(versions) == 1:
+        spec["conversion"] = {"strategy": "None"}
+    else:
+        client = spec["conversion"]["webhookClientConfig"]
+        client["caBundle"] = ca_bundle
+        client["service"]["namespace"] = namespace
+
+
+def strip_schema(schema: dict) -> None:
+    """Removes the documentation-only fields of an OpenAPI v3 schema in place."""
+
+    for field in DOC_FIELDS:
+        schema.pop(field, None)
+    for field in SUBSCHEMA:
+        if isinstance(schema.get(field), dict):
+            strip_schema(schema[field])
+    for field in SUBSCHEMA_LISTS:
+        if isinstance(schema.get(field), list):
+            for subschema in schema[field]:
+                strip_schema(subschema)
+    for field in SUBSCHEMA_MAPS:
+        for subschema in schema.get(field, {}).values():
+            strip_schema(subschema)
+
+
+def strip_descriptions(crd: dict) -> None:
+    """Removes the documentation-only fields of every schema of ``crd``."""
+
+    spec = crd["spec"]
+    schemas = [spec.get("validation")]
+    schemas.extend(version.get("schema") for version in spec.get("versions", []))
+    for schema in filter(None, schemas):
+        if "openAPIV3Schema" in schema:
+            strip_schema(schema["openAPIV3Schema"])
+
+
+if __name__ == "__main__":
+    build_bundle(*map(Path, sys.argv[1:3]))
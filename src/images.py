@@ -0,0 +1,99 @@
+"""Rewriting of the images pulled for InferenceServices.
+
+The shipped config points at public registries with mutable tags. Rewriting the
+images to a registry mirror keeps pulls on the local network, and pinning them
+to digests saves re-resolving their tags. Runtimes come as an image and a
+version the controller joins with a ``:``, so a pinned runtime keeps its image
+and gets a version of the form ``tag@sha256:...``.
+"""
+
+import re
+
+from inference_config import SIDECARS, VERSION_FIELDS, runtimes
+from options import CheckFailed
+
+DIGEST = re.compile(r"^sha256:[0-9a-f]{64}$")
+MIRROR = re.compile(r"^[a-z0-9]([-a-z0-9.]*[a-z0-9])?(:[0-9]+)?(/[a-z0-9._/-]+)?$")
+
+
+def parse_mirror(config, option: str = "image-registry-mirror") -> str:
+    """Returns the registry mirror, e.g. ``registry.local:5000/kfserving``."""
+
+    mirror = config[option].strip().rstrip("/")
+    if mirror and not MIRROR.match(mirror):
+        raise CheckFailed(f"Invalid {option}: {mirror}")
+    return mirror
+
+
+def repository(image: str) -> str:
+    """Returns the repository of ``image`` without its registry.
+
+    Images without a registry are on Docker Hub, where single names are
+    official images, e.g. ``busybox`` is ``library/busybox``.
+    """
+
+    first, sep, rest = image.partition("/")
+    if not sep:
+        return f"library/{image}"
+    if "." in first or ":" in first or first == "localhost":
+        return rest
+    return image
+
+
+def _images(config: dict) -> list:
+    """Returns the dicts holding images in ``config``, with their version fields."""
+
+    holders = [
+        (runtime, VERSION_FIELDS) for _, runtime in runtimes(config["predictors"])
+    ]
+    holders.extend(
+        (explainer, VERSION_FIELDS) for explainer in config["explainers"].values()
+    )
+    holders.extend((config[sidecar], ()) for sidecar in SIDECARS)
+    return holders
+
+
+def rewrite(image: str, mirror: str, digests: dict) -> str:
+    """Returns ``image`` on the ``mirror`` and pinned to its digest, if any."""
+
+    rewritten = f"{mirror}/{repository(image)}" if mirror else image
+    if image in digests:
+        rewritten = f"{rewritten}@{digests[image]}"
+    return rewritten
+
+
+def rewrite_config(config: dict, mirror: str, digests: dict, extra=()) -> dict:
+    """Rewrites every image of ``config`` in place, see ``rewrite``.
+
+    ``digests`` maps images as shipped, e.g. ``kfserving/agent:v0.5.1``, to
+    their digest. The ``extra`` images are rewritten too, though not part of
+    ``config``. Returns the rewritten images, keyed by the original ones.
+    """
+
+    holders = _images(config)
+    known = set(extra)
+    for holder, version_fields in holders:
+        if not version_fields:
+            known.add(holder["image"])
+        for field in filter(holder.__contains__, version_fields):
+            known.add(f"{holder['image']}:{holder[field]}")
+    for image, digest in digests.items():
+        if image not in known:
+            raise CheckFailed(f"Invalid image-digests: unknown image {image}")
+        if not isinstance(digest, str) or not DIGEST.match(digest):
+            raise CheckFailed(f"Invalid image-digests: {image} digest {digest}")
+
+    rewrites = {image: rewrite(image, mirror, digests) for image in extra}
+    for holder, version_fields in holders:
+        image = holder["image"]
+        if not version_fields:
+            rewrites[image] = holder["image"] = rewrite(image, mirror, digests)
+            continue
+        holder["image"] = rewrite(image, mirror, {})
+        for field in filter(holder.__contains__, version_fields):
+            original = f"{image}:{holder[field]}"
+            if original in digests:
+                holder[field] = f"{holder[field]}@{digests[original]}"
+            rewrites[original] = f"{holder['image']}:{holder[field]}"
+
+    return {image: new for image, new in sorted(rewrites.items()) if image != new}
@@ -0,0 +1,272 @@
+"""The inferenceservice-config ConfigMap read by the KFServing controller.
+
+The defaults shipped in ``src/config`` are loaded into dicts, so that the charm
+can adjust them from its config before they are published.
+"""
+
+import json
+import re
+from pathlib import Path
+from urllib.parse import urlparse
+
+from options import QUANTITY, CheckFailed, quantity_value
+
+CONFIG_DIR = Path("src/config")
+
+SIDECARS = ("agent", "batcher", "logger", "storageInitializer")
+RESOURCE_FIELDS = ("cpuRequest", "cpuLimit", "memoryRequest", "memoryLimit")
+# Runtimes whose servers can load TrainedModels next to each other
+MULTI_MODEL_RUNTIMES = (
+    "sklearn/v1",
+    "sklearn/v2",
+    "triton",
+    "xgboost/v1",
+    "xgboost/v2",
+)
+# Gateways are named <gateway>.<namespace>, services by their DNS name
+GATEWAY = re.compile(r"^[a-z0-9]([-a-z0-9]*[a-z0-9])?\.[a-z0-9]([-a-z0-9]*[a-z0-9])?$")
+HOSTNAME = re.compile(r"^[a-z0-9]([-a-z0-9.]*[a-z0-9])?$")
+INGRESS_OPTIONS = {
+    "ingress-gateway": ("ingressGateway", GATEWAY),
+    "ingress-service": ("ingressService", HOSTNAME),
+    "local-gateway": ("localGateway", GATEWAY),
+    "local-gateway-service": ("localGatewayService", HOSTNAME),
+}
+# ConfigMap keys an overlay can add new entries to
+EXTENSIBLE_KEYS = ("predictors", "explainers")
+# Image tags of runtimes and explainers, joined to their image by the controller
+VERSION_FIELDS = ("defaultImageVersion", "defaultGpuImageVersion")
+SIDECAR_PROFILES = {
+    "small": {
+        "cpuRequest": "50m",
+        "cpuLimit": "500m",
+        "memoryRequest": "64Mi",
+        "memoryLimit": "256Mi",
+    },
+    "standard": {
+        "cpuRequest": "100m",
+        "cpuLimit": "1",
+        "memoryRequest": "128Mi",
+        "memoryLimit": "512Mi",
+    },
+    "large": {
+        "cpuRequest": "500m",
+        "cpuLimit": "2",
+        "memoryRequest": "512Mi",
+        "memoryLimit": "2Gi",
+    },
+}
+
+
+def load(config_dir: Path = CONFIG_DIR) -> dict:
+    """Returns the shipped defaults, keyed by ConfigMap key."""
+
+    return {
+        path.stem: json.loads(path.read_text())
+        for path in sorted(config_dir.glob("*.json"))
+    }
+
+
+def dump(config: dict) -> dict:
+    """Returns the ConfigMap data for ``config``."""
+
+    return {key: json.dumps(value, indent=4) + "\n" for key, value in config.items()}
+
+
+def runtimes(predictors: dict):
+    """Yields the name and config of every predictor runtime.
+
+    Runtimes that come in several protocol versions, such as sklearn, are named
+    after their version too, e.g. ``sklearn/v2``.
+    """
+
+    for name, runtime in predictors.items():
+        if "image" in runtime:
+            yield name, runtime
+            continue
+        for version, versioned in runtime.items():
+            yield f"{name}/{version}", versioned
+
+
+def set_sidecar_resources(config: dict, profile: str, overrides: dict) -> None:
+    """Applies a named resource profile and per-sidecar overrides.
+
+    ``overrides`` maps sidecar names to some of their resource fields, e.g.
+    ``{"agent": {"memoryLimit": "512Mi"}}``, and takes precedence over the
+    profile. Without a profile, the shipped resources are kept.
+    """
+
+    if profile and profile not in SIDECAR_PROFILES:
+        raise CheckFailed(
+            f"Invalid sidecar-profile: must be one of {', '.join(SIDECAR_PROFILES)}"
+        )
+    for sidecar, resources in overrides.items():
+        if sidecar not in SIDECARS:
+            raise CheckFailed(f"Invalid sidecar-resources: unknown sidecar {sidecar}")
+        if not isinstance(resources, dict) or set(resources) - set(RESOURCE_FIELDS):
+            raise CheckFailed(
+                f"Invalid sidecar-resources: {sidecar} may only set "
+                f"{', '.join(RESOURCE_FIELDS)}"
+            )
+
+    for sidecar in SIDECARS:
+        resources = config[sidecar]
+        resources.update(SIDECAR_PROFILES.get(profile, {}))
+        resources.update({k: str(v) for k, v in overrides.get(sidecar, {}).items()})
+    check_sidecar_resources(config, "sidecar-resources")
+
+
+def check_sidecar_resources(config: dict, option: str) -> None:
+    """Checks the resource quantities of every sidecar, blaming ``option``."""
+
+    for sidecar in SIDECARS:
+        resources = config[sidecar]
+        for field in RESOURCE_FIELDS:
+            if not QUANTITY.match(resources[field]):
+                raise CheckFailed(
+                    f"Invalid {option}: {sidecar} {field} {resources[field]}"
+                )
+        for kind in ("cpu", "memory"):
+            request = quantity_value(resources[f"{kind}Request"])
+            if request > quantity_value(resources[f"{kind}Limit"]):
+                raise CheckFailed(
+                    f"Invalid {option}: {sidecar} {kind}Request exceeds {kind}Limit"
+                )
+
+
+def set_ingress(config: dict, options) -> None:
+    """Sets the gateways InferenceServices are exposed through.
+
+    The gateways and their services are taken from the charm ``options``, the
+    shipped ones being kept for empty options.
+    """
+
+    for option, (field, pattern) in INGRESS_OPTIONS.items():
+        value = options[option].strip()
+        if not value:
+            continue
+        if not pattern.match(value):
+            raise CheckFailed(f"Invalid {option}: {value}")
+        config["ingress"][field] = value
+
+
+def set_logger_url(config: dict, url: str) -> None:
+    """Points the request logger of InferenceServices at the sink at ``url``.
+
+    The shipped sink is kept if ``url`` is empty.
+    """
+
+    parsed = urlparse(url)
+    if url and (parsed.scheme not in ("http", "https") or not parsed.netloc):
+        raise CheckFailed(f"Invalid logger-url: {url}")
+
+    if url:
+        config["logger"]["defaultUrl"] = url
+
+
+def check_ingress(config: dict, option: str) -> None:
+    """Checks the gateways and services of the ingress config, blaming ``option``."""
+
+    for field, pattern in INGRESS_OPTIONS.values():
+        value = config["ingress"][field]
+        if not pattern.match(value):
+            raise CheckFailed(f"Invalid {option}: ingress.{field} {value}")
+
+
+def set_multi_model_serving(config: dict, selected: list) -> None:
+    """Lets the ``selected`` runtimes serve several TrainedModels per pod.
+
+    Runtimes are selected as in ``runtimes``, e.g. ``sklearn`` for all of its
+    protocol versions or ``sklearn/v2`` for one of them. The controller
+    injects the agent's model puller into the pods of multi-model servers.
+    """
+
+    by_name = dict(runtimes(config["predictors"]))
+    for name in selected:
+        matches = [r for r in by_name if r == name or r.startswith(f"{name}/")]
+        if not matches or set(matches) - set(MULTI_MODEL_RUNTIMES):
+            raise CheckFailed(
+                f"Invalid multi-model-runtimes: {name} does not support "
+                f"multi-model serving"
+            )
+        for runtime in matches:
+            by_name[runtime]["multiModelServer"] = True
+
+
+def check_runtimes(config: dict, option: str) -> None:
+    """Checks every predictor and explainer names its image, blaming ``option``.
+
+    Each needs a string ``image`` and ``defaultImageVersion``, and any other
+    version field must be a string too. Predictors can instead map protocol
+    versions to such runtimes, as in ``runtimes``.
+    """
+
+    for key in EXTENSIBLE_KEYS:
+        for name, entry in config[key].items():
+            path = f"{key}.{name}"
+            versioned = (
+                key == "predictors"
+                and isinstance(entry, dict)
+                and entry
+                and all(isinstance(value, dict) for value in entry.values())
+            )
+            if versioned:
+                for version, runtime in entry.items():
+                    _check_runtime(runtime, f"{path}.{version}", option)
+            else:
+                _check_runtime(entry, path, option)
+
+
+def _check_runtime(runtime, path: str, option: str) -> None:
+    if (
+        not isinstance(runtime, dict)
+        or not isinstance(runtime.get("image"), str)
+        or "defaultImageVersion" not in runtime
+    ):
+        raise CheckFailed(
+            f"Invalid {option}: {path} needs an image and defaultImageVersion"
+        )
+    for field in filter(runtime.__contains__, VERSION_FIELDS):
+        if not isinstance(runtime[field], str):
+            raise CheckFailed(f"Invalid {option}: {path}.{field} must be a str")
+
+
+def _merge(target: dict, overlay: dict, path: str) -> None:
+    for key, value in overlay.items():
+        key_path = f"{path}.{key}"
+        if key not in target:
+            if path.split(".")[0] not in EXTENSIBLE_KEYS:
+                raise CheckFailed(f"Invalid config-overlay: unknown key {key_path}")
+            target[key] = value
+        elif isinstance(target[key], dict) and isinstance(value, dict):
+            _merge(target[key], value, key_path)
+        elif type(value) is not type(target[key]):
+            raise CheckFailed(
+                f"Invalid config-overlay: {key_path} must be a "
+                f"{type(target[key]).__name__}"
+            )
+        else:
+            target[key] = value
+
+
+def apply_overlay(config: dict, overlay: dict) -> None:
+    """Deep-merges ``overlay`` over ``config``.
+
+    ``overlay`` is keyed by ConfigMap key like ``config``, e.g.
+    ``{"ingress": {"ingressGateway": "my-gateway.istio-system"}}``. Mappings
+    are merged key by key, and other values replace the ones they overlay,
+    which they must match the type of. Only predictors and explainers can be
+    added, other unknown keys are rejected, and they must name their image as
+    checked by ``check_runtimes``. The merged sidecar resources and ingress
+    gateways are checked like the options setting them.
+    """
+
+    for key, value in overlay.items():
+        if key not in config:
+            raise CheckFailed(f"Invalid config-overlay: unknown key {key}")
+        if not isinstance(value, dict):
+            raise CheckFailed(f"Invalid config-overlay: {key} must be a mapping")
+        _merge(config[key], value, key)
+    check_runtimes(config, "config-overlay")
+    check_sidecar_resources(config, "config-overlay")
+    check_ingress(config, "config-overlay")
@@ -0,0 +1,72 @@
+"""Prometheus scraping of the KFServing controller metrics.
+
+The controller-runtime metrics of the manager, such as reconcile durations,
+work queue depths and webhook latencies, are kept by each manager pod, so every
+pod is handed to Prometheus as a target over the ``prometheus_scrape``
+interface, rather than the Service in front of them. The alert rules in
+``src/prometheus_alert_rules`` go along, their ``%%juju_topology%%`` selectors
+scoped to the series of this application.
+"""
+
+import json
+from pathlib import Path
+
+import yaml
+
+SERVICE = "kfserving-controller-manager-metrics-service"
+ALERT_RULES_DIR = Path("src/prometheus_alert_rules")
+
+
+def service(port: int) -> dict:
+    return {
+        "name": SERVICE,
+        "spec": {
+            "selector": {"app.kubernetes.io/name": "kfserving"},
+            "ports": [
+                {"name": "metrics", "protocol": "TCP", "port": port, "targetPort": port}
+            ],
+        },
+    }
+
+
+def alert_rules(topology: dict, rules_dir: Path = ALERT_RULES_DIR) -> dict:
+    """Returns the alert rule groups of every ``.rule`` file in ``rules_dir``.
+
+    ``%%juju_topology%%`` in the rules is replaced with a label matcher for
+    each of the ``topology`` labels, e.g. ``juju_application="kfserving"``.
+    """
+
+    selector = ",".join(f'{label}="{value}"' for label, value in topology.items())
+    groups = []
+    for path in sorted(rules_dir.glob("*.rule")):
+        rules = path.read_text().replace("%%juju_topology%%", selector)
+        groups.extend(yaml.safe_load(rules)["groups"])
+    return {"groups": groups}
+
+
+def relation_data(model, model_uuid: str, port: int, pods: dict) -> dict:
+    """Returns the application data of a ``prometheus_scrape`` relation.
+
+    ``pods`` maps the names of the manager pods to their IP, each of them is
+    scraped as a target of its own.
+    """
+
+    job = {
+        "job_name": f"{model.name}_{model.app.name}_manager",
+        "metrics_path": "/metrics",
+        "static_configs": [
+            {"targets": [f"{ip}:{port}"], "labels": {"pod": name}}
+            for name, ip in sorted(pods.items())
+        ],
+    }
+    metadata = {
+        "model": model.name,
+        "model_uuid": model_uuid,
+        "application": model.app.name,
+    }
+    topology = {f"juju_{key}": value for key, value in metadata.items()}
+    return {
+        "scrape_metadata": json.dumps(metadata),
+        "scrape_jobs": json.dumps([job]),
+        "alert_rules": json.dumps(alert_rules(topology)),
+    }
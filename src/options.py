@@ -0,0 +1,126 @@
+"""Parsing and validation of charm config options.
+
+Every parser raises ``CheckFailed`` with a message naming the offending option,
+so that an invalid option blocks the unit instead of reaching the pod spec.
+"""
+
+import re
+from ipaddress import ip_address
+
+import yaml
+from ops.model import BlockedStatus
+
+QUANTITY = re.compile(r"^([0-9]+(\.[0-9]+)?|\.[0-9]+)(m|[KMGTPE]i|[kMGTPE])?$")
+GO_MEMORY = re.compile(r"^[0-9]+(B|KiB|MiB|GiB|TiB)?$")
+LABEL_NAME = r"[A-Za-z0-9]([-A-Za-z0-9_.]*[A-Za-z0-9])?"
+LABEL_KEY = re.compile(rf"^([a-z0-9]([-a-z0-9.]*[a-z0-9])?/)?{LABEL_NAME}$")
+LABEL_VALUE = re.compile(rf"^({LABEL_NAME})?$")
+
+_SUFFIXES = {
+    "m": 1e-3,
+    "k": 1e3,
+    "M": 1e6,
+    "G": 1e9,
+    "T": 1e12,
+    "P": 1e15,
+    "E": 1e18,
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+    "Pi": 2**50,
+    "Ei": 2**60,
+}
+
+
+class CheckFailed(Exception):
+    """Raised when the charm cannot proceed with its current config."""
+
+    def __init__(self, msg, status_type=BlockedStatus):
+        super().__init__(msg)
+        self.msg = msg
+        self.status = status_type(msg)
+
+
+def parse_port(config, option: str) -> int:
+    try:
+        port = int(config[option])
+    except ValueError:
+        port = 0
+    if not 0 < port < 65536:
+        raise CheckFailed(f"Invalid {option}: {config[option]}")
+    return port
+
+
+def parse_quantity(config, option: str) -> str:
+    """Returns a Kubernetes resource quantity, or None if the option is empty."""
+
+    value = str(config[option]).strip()
+    if not value:
+        return None
+    if not QUANTITY.match(value):
+        raise CheckFailed(f"Invalid {option}: {value}")
+    return value
+
+
+def quantity_value(quantity: str) -> float:
+    """Returns the numeric value of a quantity accepted by ``parse_quantity``."""
+
+    for suffix in sorted(_SUFFIXES, key=len, reverse=True):
+        if quantity.endswith(suffix):
+            return float(quantity[: -len(suffix)]) * _SUFFIXES[suffix]
+    return float(quantity)
+
+
+def parse_go_memory(config, option: str) -> str:
+    """Returns a Go runtime memory size such as ``900MiB``, or None if empty."""
+
+    value = str(config[option]).strip()
+    if not value:
+        return None
+    if not GO_MEMORY.match(value):
+        raise CheckFailed(f"Invalid {option}: {value}")
+    return value
+
+
+def parse_ip(config, option: str) -> str:
+    """Returns an IP address, or an empty string for all interfaces."""
+
+    value = str(config[option]).strip()
+    if not value:
+        return ""
+    try:
+        return str(ip_address(value))
+    except ValueError:
+        raise CheckFailed(f"Invalid {option}: {value}")
+
+
+def parse_labels(config, option: str) -> dict:
+    """Parses a comma-separated list of ``key=value`` labels."""
+
+    labels = {}
+    for item in filter(None, (i.strip() for i in config[option].split(","))):
+        key, sep, value = item.partition("=")
+        key, value = key.strip(), value.strip()
+        if not sep or not LABEL_KEY.match(key) or not LABEL_VALUE.match(value):
+            raise CheckFailed(f"Invalid {option}: {item}")
+        labels[key] = value
+    return labels
+
+
+def parse_yaml(config, option: str, expected_type, default=None):
+    """Parses an option holding YAML (or JSON) of the expected type."""
+
+    value = config[option]
+    if not value.strip():
+        return default
+    try:
+        parsed = yaml.safe_load(value)
+    except yaml.YAMLError:
+        raise CheckFailed(f"Invalid {option}: not valid YAML")
+    if not isinstance(parsed, expected_type):
+        raise CheckFailed(
+            f"Invalid {option}: expected a {expected_type.__name__} "
+            f"but got {type(parsed).__name__}"
+        )
+    return parsed
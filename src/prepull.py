@@ -0,0 +1,96 @@
+"""DaemonSet keeping serving runtime images warm on the nodes.
+
+The first predictor of a runtime landing on a node has to pull the runtime,
+agent and storage initializer images before it can serve, which dominates the
+latency of scaling from zero. The DaemonSet pulls them ahead of time, by running
+each image as an init container that exits immediately. Runtime images need not
+ship a shell, so a static busybox is copied into a shared volume and run in each
+of them instead.
+"""
+
+import inference_config
+from options import CheckFailed
+
+BUSYBOX_IMAGE = "busybox:1.33.1-musl"
+PAUSE_IMAGE = "k8s.gcr.io/pause:3.2"
+SIDECARS = ("agent", "storageInitializer")
+
+_RESOURCES = {
+    "requests": {"cpu": "10m", "memory": "16Mi"},
+    "limits": {"cpu": "100m", "memory": "64Mi"},
+}
+
+
+def images(config: dict, selected: list) -> list:
+    """Returns the images to keep warm for the ``selected`` runtimes.
+
+    A runtime can be selected by name, e.g. ``sklearn`` for all of its protocol
+    versions, or with its protocol version, e.g. ``sklearn/v2``.
+    """
+
+    runtimes = dict(inference_config.runtimes(config["predictors"]))
+    selected_runtimes = []
+    for name in selected:
+        matches = [r for r in runtimes if r == name or r.startswith(f"{name}/")]
+        if not matches:
+            raise CheckFailed(f"Invalid prepull-runtimes: unknown runtime {name}")
+        selected_runtimes.extend(matches)
+
+    pulled = [
+        f"{runtimes[name]['image']}:{runtimes[name]['defaultImageVersion']}"
+        for name in selected_runtimes
+    ]
+    pulled.extend(config[sidecar]["image"] for sidecar in SIDECARS)
+    return sorted(set(pulled))
+
+
+def daemonset(
+    name: str,
+    namespace: str,
+    images: list,
+    node_labels: dict,
+    busybox_image: str = BUSYBOX_IMAGE,
+    pause_image: str = PAUSE_IMAGE,
+) -> dict:
+    labels = {"app.kubernetes.io/name": name}
+    volume_mounts = [{"name": "prepull", "mountPath": "/prepull"}]
+    init_containers = [
+        {
+            "name": "busybox",
+            "image": busybox_image,
+            "command": ["cp", "/bin/busybox", "/prepull/busybox"],
+            "resources": _RESOURCES,
+            "volumeMounts": volume_mounts,
+        }
+    ]
+    init_containers.extend(
+        {
+            "name": f"image-{i}",
+            "image": image,
+            "imagePullPolicy": "IfNotPresent",
+            "command": ["/prepull/busybox", "true"],
+            "resources": _RESOURCES,
+            "volumeMounts": volume_mounts,
+        }
+        for i, image in enumerate(images)
+    )
+
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "DaemonSet",
+        "metadata": {"name": name, "namespace": namespace, "labels": labels},
+        "spec": {
+            "selector": {"matchLabels": labels},
+            "template": {
+                "metadata": {"labels": labels},
+                "spec": {
+                    "nodeSelector": node_labels or None,
+                    "initContainers": init_containers,
+                    "containers": [
+                        {"name": "pause", "image": pause_image, "resources": _RESOURCES}
+                    ],
+                    "volumes": [{"name": "prepull", "emptyDir": {}}],
+                },
+            },
+        },
+    }
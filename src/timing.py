@@ -0,0 +1,77 @@
+"""Per-phase timing of charm hooks."""
+
+import json
+import logging
+from contextlib import contextmanager
+from time import perf_counter
+
+log = logging.getLogger(__name__)
+
+
+def payload_size(payload) -> int:
+    """Returns the size in bytes of ``payload`` once serialized."""
+
+    if isinstance(payload, bytes):
+        return len(payload)
+    if not isinstance(payload, str):
+        payload = json.dumps(payload, separators=(",", ":"))
+    return len(payload.encode("utf-8"))
+
+
+class Span:
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.bytes = None
+
+    def measure(self, payload):
+        """Records the serialized size of ``payload`` against this span."""
+
+        self.bytes = payload_size(payload)
+
+    def to_dict(self) -> dict:
+        span = {"name": self.name, "seconds": round(self.seconds, 6)}
+        if self.bytes is not None:
+            span["bytes"] = self.bytes
+        return span
+
+
+class HookTimer:
+    """Collects timing spans for the phases of a single hook.
+
+    Spans may nest or run concurrently, so the hook total is not their sum but
+    the time since the timer was started.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.started = perf_counter()
+
+    def start(self):
+        """Starts timing a hook afresh, dropping the spans recorded so far."""
+
+        self.spans = []
+        self.started = perf_counter()
+
+    @contextmanager
+    def span(self, name: str):
+        span = Span(name)
+        start = perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = perf_counter() - start
+            self.spans.append(span)
+            log.debug(json.dumps({"span": span.to_dict()}))
+
+    def report(self, hook: str) -> dict:
+        """Logs and returns the breakdown of the spans recorded since the last report."""
+
+        report = {
+            "hook": hook,
+            "seconds": round(perf_counter() - self.started, 6),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+        self.start()
+        log.info(json.dumps({"hook-timings": report}))
+        return report
@@ -0,0 +1,214 @@
+"""Admission webhook configurations of the KFServing controller."""
+
+import socket
+import ssl
+from copy import deepcopy
+
+from options import CheckFailed
+
+SERVICE = "kfserving-webhook-server-service"
+FAILURE_POLICIES = ("Fail", "Ignore")
+OVERRIDE_FIELDS = {"timeoutSeconds", "failurePolicy"}
+
+# Served InferenceService API versions, in order of preference
+ISVC_VERSIONS = ("v1alpha2", "v1beta1")
+
+POD_MUTATOR_SELECTORS = {
+    "namespaceSelector": {
+        "matchExpressions": [{"key": "control-plane", "operator": "DoesNotExist"}]
+    },
+    "objectSelector": {
+        "matchExpressions": [
+            {"key": "serving.kubeflow.org/inferenceservice", "operator": "Exists"}
+        ]
+    },
+}
+
+# (kind, configuration, webhook, path, api group, api version, resource)
+WEBHOOKS = [
+    (
+        "mutating",
+        "inferenceservice.serving.kubeflow.org",
+        "inferenceservice.kfserving-webhook-server.defaulter",
+        "/mutate-serving-kubeflow-org-v1alpha2-inferenceservice",
+        "serving.kubeflow.org",
+        "v1alpha2",
+        "inferenceservices",
+    ),
+    (
+        "mutating",
+        "inferenceservice.serving.kubeflow.org",
+        "inferenceservice.kfserving-webhook-server.v1beta1.defaulter",
+        "/mutate-serving-kubeflow-org-v1beta1-inferenceservice",
+        "serving.kubeflow.org",
+        "v1beta1",
+        "inferenceservices",
+    ),
+    (
+        "mutating",
+        "inferenceservice.serving.kubeflow.org",
+        "inferenceservice.kfserving-webhook-server.pod-mutator",
+        "/mutate-pods",
+        "",
+        "v1",
+        "pods",
+    ),
+    (
+        "validating",
+        "inferenceservice.serving.kubeflow.org",
+        "inferenceservice.kfserving-webhook-server.validator",
+        "/validate-serving-kubeflow-org-v1alpha2-inferenceservice",
+        "serving.kubeflow.org",
+        "v1alpha2",
+        "inferenceservices",
+    ),
+    (
+        "validating",
+        "inferenceservice.serving.kubeflow.org",
+        "inferenceservice.kfserving-webhook-server.v1beta1.validator",
+        "/validate-serving-kubeflow-org-v1beta1-inferenceservice",
+        "serving.kubeflow.org",
+        "v1beta1",
+        "inferenceservices",
+    ),
+    (
+        "validating",
+        "trainedmodel.serving.kubeflow.org",
+        "trainedmodel.kfserving-webhook-server.validator",
+        "/validate-serving-kubeflow-org-v1alpha1-trainedmodel",
+        "serving.kubeflow.org",
+        "v1alpha1",
+        "trainedmodels",
+    ),
+]
+
+
+def parse_served_versions(config, option: str = "served-api-versions") -> list:
+    """Returns the served InferenceService versions, in order of preference."""
+
+    versions = {v.strip() for v in config[option].split(",") if v.strip()}
+    if not versions or not versions <= set(ISVC_VERSIONS):
+        raise CheckFailed(
+            f"Invalid {option}: must be a subset of {','.join(ISVC_VERSIONS)}"
+        )
+    return [version for version in ISVC_VERSIONS if version in versions]
+
+
+def render(ca_bundle: str, namespace: str, served_versions: list):
+    """Returns the mutating and validating webhook configurations.
+
+    The InferenceService webhooks of versions that are not served are left out.
+    """
+
+    configurations = {"mutating": {}, "validating": {}}
+    for kind, configuration, name, path, group, version, resource in WEBHOOKS:
+        if resource == "inferenceservices" and version not in served_versions:
+            continue
+
+        webhook = {
+            "clientConfig": {
+                "caBundle": ca_bundle,
+                "service": {"name": SERVICE, "namespace": namespace, "path": path},
+            },
+            "failurePolicy": "Fail",
+            "name": name,
+            "rules": [
+                {
+                    "apiGroups": [group],
+                    "apiVersions": [version],
+                    "operations": ["CREATE", "UPDATE"],
+                    "resources": [resource],
+                }
+            ],
+        }
+        if resource == "pods":
+            webhook.update(deepcopy(POD_MUTATOR_SELECTORS))
+
+        configurations[kind].setdefault(
+            configuration, {"name": configuration, "webhooks": []}
+        )["webhooks"].append(webhook)
+
+    return (
+        list(configurations["mutating"].values()),
+        list(configurations["validating"].values()),
+    )
+
+
+def _check_timeout(timeout, option):
+    # The API server caps webhook timeouts at 30 seconds
+    if (
+        isinstance(timeout, bool)
+        or not isinstance(timeout, int)
+        or not 1 <= timeout <= 30
+    ):
+        raise CheckFailed(f"Invalid {option}: timeout must be 1-30 seconds")
+
+
+def _check_failure_policy(policy, option):
+    if policy not in FAILURE_POLICIES:
+        raise CheckFailed(f"Invalid {option}: failure policy must be Fail or Ignore")
+
+
+def scope(configurations, timeout, failure_policy, overrides, namespace_labels):
+    """Bounds the latency and scope of every webhook in ``configurations``.
+
+    Every webhook gets an explicit timeout and failure policy, which can be
+    overridden per webhook name, and is declared free of side effects. If
+    ``namespace_labels`` is given, the pod mutator only applies to namespaces
+    that carry all of those labels. The InferenceService and TrainedModel
+    webhooks keep applying everywhere, as those resources must never be
+    admitted without defaulting and validation.
+    """
+
+    _check_timeout(timeout, "webhook-timeout")
+    _check_failure_policy(failure_policy, "webhook-failure-policy")
+
+    webhooks = {
+        webhook["name"]: webhook
+        for configuration in configurations
+        for webhook in configuration["webhooks"]
+    }
+    for name, override in overrides.items():
+        if name not in webhooks:
+            raise CheckFailed(f"Invalid webhook-overrides: unknown webhook {name}")
+        if not isinstance(override, dict) or not set(override) <= OVERRIDE_FIELDS:
+            raise CheckFailed(
+                f"Invalid webhook-overrides: {name} may only set "
+                "timeoutSeconds and failurePolicy"
+            )
+        if "timeoutSeconds" in override:
+            _check_timeout(override["timeoutSeconds"], "webhook-overrides")
+        if "failurePolicy" in override:
+            _check_failure_policy(override["failurePolicy"], "webhook-overrides")
+
+    for name, webhook in webhooks.items():
+        webhook["sideEffects"] = "None"
+        webhook["timeoutSeconds"] = timeout
+        webhook["failurePolicy"] = failure_policy
+        webhook.update(overrides.get(name, {}))
+
+        if namespace_labels and _is_pod_mutator(webhook):
+            selector = webhook.setdefault("namespaceSelector", {})
+            selector["matchLabels"] = dict(namespace_labels)
+
+    return configurations
+
+
+def _is_pod_mutator(webhook) -> bool:
+    return any("pods" in rule["resources"] for rule in webhook["rules"])
+
+
+def ready(host: str, port: int, ca: str, timeout: float = 2.0) -> bool:
+    """Returns whether the webhook server at ``host`` completes a TLS handshake.
+
+    The server certificate must be signed by ``ca`` and valid for ``host``, as
+    the API server requires of webhooks.
+    """
+
+    context = ssl.create_default_context(cadata=ca)
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            with context.wrap_socket(sock, server_hostname=host):
+                return True
+    except OSError:
+        return False
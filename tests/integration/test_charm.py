@@ -22,7 +22,7 @@ async def test_build_and_deploy(ops_test):
     # deploy charm
     image_path = METADATA["resources"]["oci-image"]["upstream-source"]
     resources = {"oci-image": image_path}
-    await ops_test.model.deploy(charm_under_test, resources=resources)
+    await ops_test.model.deploy(charm_under_test, resources=resources, trust=True)
 
     # wait until active and idle
     await ops_test.model.wait_for_idle(
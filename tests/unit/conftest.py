@@ -0,0 +1,81 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from lightkube import codecs
+from ops.testing import Harness
+
+from charm import Operator
+
+CHARM_ROOT = Path(__file__).parents[2]
+
+IMAGE_DETAILS = {
+    "registrypath": "gcr.io/kfserving/kfserving-controller:v0.5.1",
+    "username": "",
+    "password": "",
+}
+
+# The manager Deployment once its pods all run the latest pod template
+ROLLED_OUT = codecs.from_dict(
+    {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {"name": "kfserving", "generation": 1},
+        "spec": {
+            "selector": {},
+            "template": {"spec": {"containers": [{"name": "manager"}]}},
+        },
+        "status": {
+            "observedGeneration": 1,
+            "replicas": 1,
+            "updatedReplicas": 1,
+            "readyReplicas": 1,
+        },
+    }
+)
+
+
+@pytest.fixture(autouse=True)
+def charm_root(monkeypatch):
+    # The charm reads its bundled files relative to the charm root, like under Juju
+    monkeypatch.chdir(CHARM_ROOT)
+
+
+@pytest.fixture(autouse=True)
+def lightkube_client(monkeypatch):
+    # The charm applies some resources with lightkube, besides the pod spec
+    client = MagicMock()
+    client.get.return_value = ROLLED_OUT
+    monkeypatch.setattr("charm.Client", lambda: client)
+    return client
+
+
+@pytest.fixture(autouse=True)
+def webhook_ready(monkeypatch):
+    # There is no webhook server to probe, it answers unless a test says otherwise
+    ready = MagicMock(return_value=True)
+    monkeypatch.setattr("charm.webhooks.ready", ready)
+    return ready
+
+
+@pytest.fixture
+def make_harness():
+    harnesses = []
+
+    def make_harness(leader=True, image_details=IMAGE_DETAILS):
+        harness = Harness(Operator)
+        harness.set_leader(leader)
+        if image_details is not None:
+            harness.add_oci_resource("oci-image", image_details)
+        harnesses.append(harness)
+        return harness
+
+    yield make_harness
+
+    for harness in harnesses:
+        harness.cleanup()
+
+
+@pytest.fixture
+def harness(make_harness):
+    return make_harness()
@@ -0,0 +1,951 @@
+import json
+import math
+from datetime import datetime, timedelta
+from time import sleep
+from unittest.mock import MagicMock
+
+import httpx
+import pytest
+from lightkube import codecs
+from lightkube.core.exceptions import ApiError
+from lightkube.resources.core_v1 import ConfigMap, Secret
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+
+import charm
+import inference_config
+
+
+def manager(harness):
+    spec, _ = harness.get_pod_spec()
+    return spec["containers"][0]
+
+
+def applied(lightkube_client, kind):
+    """Returns the last resource of ``kind`` the charm applied with lightkube."""
+
+    calls = lightkube_client.create.call_args_list
+    return [call[0][0] for call in calls if call[0][0].kind == kind][-1]
+
+
+def api_error(code):
+    return ApiError(response=httpx.Response(code, json={"code": code, "message": ""}))
+
+
+def test_not_leader(make_harness):
+    harness = make_harness(leader=False)
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == ActiveStatus()
+    assert harness.get_pod_spec() is None
+
+
+def test_missing_image(make_harness):
+    harness = make_harness(image_details=None)
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        "Missing resource: oci-image"
+    )
+
+
+def test_pod_spec(harness, lightkube_client):
+    harness.begin_with_initial_hooks()
+    spec, resources = harness.get_pod_spec()
+
+    assert harness.charm.model.unit.status == ActiveStatus()
+    container = spec["containers"][0]
+    assert container["args"] == ["--metrics-addr=:8080"]
+    assert container["envConfig"] == {"POD_NAMESPACE": harness.model.name}
+    assert [
+        crd["name"]
+        for crd in resources["kubernetesResources"]["customResourceDefinitions"]
+    ] == [
+        "trainedmodels.serving.kubeflow.org",
+        "inferenceservices.serving.kubeflow.org",
+    ]
+    assert set(isvc_config(lightkube_client)) == {
+        "agent",
+        "batcher",
+        "credentials",
+        "explainers",
+        "ingress",
+        "logger",
+        "predictors",
+        "storageInitializer",
+        "transformers",
+    }
+
+
+def test_inputs_prepared_concurrently(harness, monkeypatch):
+    def slow(func):
+        def slow_func(*args, **kwargs):
+            sleep(0.2)
+            return func(*args, **kwargs)
+
+        return slow_func
+
+    monkeypatch.setattr("charm.gen_certs", slow(charm.gen_certs))
+    monkeypatch.setattr("inference_config.load", slow(inference_config.load))
+    harness.begin()
+    harness.charm.on.install.emit()
+
+    timings = json.loads(harness.charm._stored.hook_timings)
+    spans = {span["name"]: span["seconds"] for span in timings["spans"]}
+    assert spans["certs"] >= 0.2
+    assert spans["config-load"] >= 0.2
+    # Both slow inputs were prepared at once, not one after the other
+    assert spans["prepare"] < spans["certs"] + spans["config-load"]
+    # The hook total is measured as a whole, the nested spans are not added up
+    assert timings["seconds"] < sum(spans.values())
+    assert harness.charm._stored.image_details["imagePath"]
+
+
+def test_certs_generated_once(harness):
+    harness.begin_with_initial_hooks()
+    cert = harness.charm._stored.cert
+    harness.update_config({"webhook-port": "9444"})
+    assert harness.charm._stored.cert == cert
+    assert "BEGIN CERTIFICATE" in cert
+
+
+def test_unchanged_spec_not_set_again(harness):
+    harness.begin_with_initial_hooks()
+    harness.model.pod.set_spec = MagicMock()
+    harness.charm.on.config_changed.emit()
+    harness.model.pod.set_spec.assert_not_called()
+
+    harness.update_config({"webhook-port": "9444"})
+    harness.model.pod.set_spec.assert_called_once()
+
+
+def test_controller_tuning(harness, lightkube_client):
+    harness.update_config(
+        {
+            "metrics-bind-address": "127.0.0.1",
+            "metrics-port": "8081",
+            "leader-election": True,
+            "cpu-request": "500m",
+            "cpu-limit": "1500m",
+            "memory-limit": "1Gi",
+            "gomemlimit": "900MiB",
+            "node-selector": "kubernetes.io/os=linux",
+            "tolerations": "[{key: dedicated, operator: Exists, effect: NoSchedule}]",
+        }
+    )
+    harness.begin_with_initial_hooks()
+
+    assert harness.charm.model.unit.status == ActiveStatus()
+    container = manager(harness)
+    assert container["args"] == [
+        "--metrics-addr=127.0.0.1:8081",
+        "--enable-leader-election",
+    ]
+    # Rounded down, as more threads than the quota allows would get throttled
+    assert container["envConfig"]["GOMAXPROCS"] == "1"
+    assert container["envConfig"]["GOMEMLIMIT"] == "900MiB"
+
+    _, name, patch = lightkube_client.patch.call_args[0]
+    assert name == "kfserving"
+    pod = patch["spec"]["template"]["spec"]
+    assert pod["containers"] == [
+        {
+            "name": "manager",
+            "resources": {
+                "requests": {"cpu": "500m"},
+                "limits": {"cpu": "1500m", "memory": "1Gi"},
+            },
+        }
+    ]
+    assert pod["nodeSelector"] == {"kubernetes.io/os": "linux"}
+    assert pod["tolerations"] == [
+        {"key": "dedicated", "operator": "Exists", "effect": "NoSchedule"}
+    ]
+
+
+def deployment(resources=None, node_selector=None):
+    return codecs.from_dict(
+        {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {"name": "kfserving"},
+            "spec": {
+                "selector": {},
+                "template": {
+                    "spec": {
+                        "containers": [{"name": "manager", "resources": resources}],
+                        "nodeSelector": node_selector,
+                    }
+                },
+            },
+        }
+    )
+
+
+def test_workload_patched_after_pod_spec(harness, lightkube_client):
+    harness.update_config({"cpu-limit": "0.5", "node-selector": "gpu=true"})
+    harness.begin()
+    harness.charm.on.install.emit()
+    # Juju re-creates the pod template after this hook, patching it would be lost
+    lightkube_client.patch.assert_not_called()
+
+    lightkube_client.get.return_value = deployment()
+    harness.charm.on.update_status.emit()
+    lightkube_client.patch.assert_called_once()
+
+    lightkube_client.patch.reset_mock()
+    lightkube_client.get.return_value = deployment(
+        {"limits": {"cpu": "500m"}}, {"gpu": "true"}
+    )
+    harness.charm.on.update_status.emit()
+    harness.charm.on.config_changed.emit()
+    lightkube_client.patch.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "config, message",
+    [
+        ({"metrics-port": "http"}, "Invalid metrics-port: http"),
+        (
+            {"metrics-bind-address": "localhost"},
+            "Invalid metrics-bind-address: localhost",
+        ),
+        ({"cpu-limit": "two"}, "Invalid cpu-limit: two"),
+        (
+            {"memory-request": "2Gi", "memory-limit": "1Gi"},
+            "memory-request must not exceed memory-limit",
+        ),
+        ({"gomemlimit": "1G"}, "Invalid gomemlimit: 1G"),
+        ({"node-selector": "infra"}, "Invalid node-selector: infra"),
+        (
+            {"tolerations": "{key: infra}"},
+            "Invalid tolerations: expected a list but got dict",
+        ),
+        (
+            {"tolerations": "[{effect: Never}]"},
+            "Invalid tolerations: {'effect': 'Never'}",
+        ),
+    ],
+)
+def test_invalid_controller_tuning(harness, config, message):
+    harness.update_config(config)
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(message)
+    assert harness.get_pod_spec() is None
+
+
+def test_multiple_units(harness):
+    harness.begin_with_initial_hooks()
+    assert "--enable-leader-election" not in manager(harness)["args"]
+
+    relation_id = harness.model.get_relation("replicas").id
+    harness.add_relation_unit(relation_id, "kfserving/1")
+
+    assert "--enable-leader-election" in manager(harness)["args"]
+    shared = harness.get_relation_data(relation_id, "kfserving")
+    assert shared["cert"] == harness.charm._stored.cert
+    assert shared["ca"] == harness.charm._stored.ca
+
+
+def test_remove(harness, lightkube_client):
+    harness.begin_with_initial_hooks()
+    harness.charm.on.remove.emit()
+    deleted = {call.args[:2] for call in lightkube_client.delete.call_args_list}
+    assert deleted == {
+        (ConfigMap, "inferenceservice-config"),
+        (Secret, "kfserving-webhook-server-cert"),
+    }
+
+    # Other units keep using the shared resources
+    lightkube_client.delete.reset_mock()
+    relation_id = harness.model.get_relation("replicas").id
+    harness.add_relation_unit(relation_id, "kfserving/1")
+    harness.charm.on.remove.emit()
+    lightkube_client.delete.assert_not_called()
+
+
+def test_new_leader_adopts_shared_certs(harness):
+    relation_id = harness.add_relation("replicas", "kfserving")
+    harness.update_relation_data(
+        relation_id, "kfserving", {"cert": "cert", "key": "key", "ca": "ca"}
+    )
+    harness.begin()
+    assert harness.charm._stored.cert == "cert"
+    assert harness.charm._stored.key == "key"
+
+
+def test_config_map_applied_in_place(harness, lightkube_client):
+    harness.begin_with_initial_hooks()
+    container = manager(harness)
+    assert container["volumeConfig"][0]["secret"] == {
+        "name": "kfserving-webhook-server-cert"
+    }
+    secret = applied(lightkube_client, "Secret")
+    assert secret.stringData["tls.crt"] == harness.charm._stored.cert
+
+    harness.model.pod.set_spec = MagicMock()
+    lightkube_client.create.reset_mock()
+    harness.update_config({"sidecar-profile": "large"})
+
+    harness.model.pod.set_spec.assert_not_called()
+    assert isvc_config(lightkube_client)["agent"]["memoryLimit"] == "2Gi"
+    assert [call[0][0].kind for call in lightkube_client.create.call_args_list] == [
+        "ConfigMap"
+    ]
+
+
+def test_certs_renewed_in_place(harness, lightkube_client, monkeypatch):
+    harness.begin_with_initial_hooks()
+    cert, ca = harness.charm._stored.cert, harness.charm._stored.ca
+
+    harness.model.pod.set_spec = MagicMock()
+    harness.charm.on.update_status.emit()
+    assert harness.charm._stored.cert == cert
+
+    # Certificates are valid for a year, renew them as if close to expiry
+    monkeypatch.setattr("charm.CERT_RENEWAL", timedelta(days=400))
+    harness.charm.on.update_status.emit()
+    assert harness.charm._stored.cert != cert
+    assert harness.charm._stored.ca == ca
+    secret = applied(lightkube_client, "Secret")
+    assert secret.stringData["tls.crt"] == harness.charm._stored.cert
+
+    harness.charm.on.config_changed.emit()
+    harness.model.pod.set_spec.assert_not_called()
+
+
+def test_pruned_in_place_resources_applied_again(harness, lightkube_client):
+    harness.begin_with_initial_hooks()
+    lightkube_client.create.reset_mock()
+    harness.charm.on.config_changed.emit()
+    lightkube_client.create.assert_not_called()
+
+    # Juju prunes what the previous pod spec owned after the hook changing it
+    harness.update_config({"webhook-port": "8443"})
+
+    rolled_out = lightkube_client.get.return_value
+
+    def get(resource, name, namespace):
+        if resource.__name__ == "ConfigMap":
+            raise api_error(404)
+        return rolled_out
+
+    lightkube_client.get.side_effect = get
+    lightkube_client.create.reset_mock()
+    harness.charm.on.config_changed.emit()
+    assert [call[0][0].kind for call in lightkube_client.create.call_args_list] == [
+        "ConfigMap"
+    ]
+
+    lightkube_client.create.reset_mock()
+    harness.charm.on.update_status.emit()
+    assert [call[0][0].kind for call in lightkube_client.create.call_args_list] == [
+        "ConfigMap"
+    ]
+
+
+def pod(name, ip):
+    return codecs.from_dict(
+        {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {"name": name},
+            "status": {"podIP": ip},
+        }
+    )
+
+
+def test_metrics_endpoint(harness, lightkube_client):
+    relation_id = harness.add_relation("metrics-endpoint", "prometheus")
+    harness.update_config({"metrics-port": "8081"})
+    lightkube_client.list.return_value = [pod("kfserving-0", "10.1.0.5")]
+    harness.begin_with_initial_hooks()
+
+    _, resources = harness.get_pod_spec()
+    services = resources["kubernetesResources"]["services"]
+    assert services[1]["name"] == "kfserving-controller-manager-metrics-service"
+    assert services[1]["spec"]["ports"][0]["port"] == 8081
+
+    data = harness.get_relation_data(relation_id, "kfserving")
+    [job] = json.loads(data["scrape_jobs"])
+    assert job["static_configs"] == [
+        {"targets": ["10.1.0.5:8081"], "labels": {"pod": "kfserving-0"}}
+    ]
+    rules = {
+        rule["alert"]: rule
+        for group in json.loads(data["alert_rules"])["groups"]
+        for rule in group["rules"]
+    }
+    assert "KFServingReconcileSlow" in rules
+    expr = rules["KFServingWorkQueueDepthHigh"]["expr"]
+    assert 'workqueue_depth{juju_model="' in expr
+    assert 'juju_application="kfserving"}' in expr
+
+    # A rollout replaces the pods, each of them is scraped on its own
+    lightkube_client.list.return_value = [
+        pod("kfserving-1", "10.1.0.6"),
+        pod("kfserving-2", "10.1.0.7"),
+    ]
+    harness.charm.on.update_status.emit()
+    data = harness.get_relation_data(relation_id, "kfserving")
+    [job] = json.loads(data["scrape_jobs"])
+    assert [config["targets"] for config in job["static_configs"]] == [
+        ["10.1.0.6:8081"],
+        ["10.1.0.7:8081"],
+    ]
+
+
+def webhooks(harness):
+    _, resources = harness.get_pod_spec()
+    return {
+        webhook["name"]: webhook
+        for kind in ("mutatingWebhookConfigurations", "validatingWebhookConfigurations")
+        for configuration in resources["kubernetesResources"][kind]
+        for webhook in configuration["webhooks"]
+    }
+
+
+def test_webhook_scope(harness):
+    harness.update_config(
+        {
+            "webhook-namespace-selector": "serving.kubeflow.org/inferenceservice=enabled",
+            "webhook-timeout": 5,
+            "webhook-overrides": (
+                "{inferenceservice.kfserving-webhook-server.pod-mutator: "
+                "{failurePolicy: Ignore, timeoutSeconds: 2}}"
+            ),
+        }
+    )
+    harness.begin_with_initial_hooks()
+
+    hooks = webhooks(harness)
+    pod_mutator = hooks.pop("inferenceservice.kfserving-webhook-server.pod-mutator")
+    assert pod_mutator["failurePolicy"] == "Ignore"
+    assert pod_mutator["timeoutSeconds"] == 2
+    assert pod_mutator["namespaceSelector"] == {
+        "matchLabels": {"serving.kubeflow.org/inferenceservice": "enabled"},
+        "matchExpressions": [{"key": "control-plane", "operator": "DoesNotExist"}],
+    }
+    for webhook in hooks.values():
+        assert webhook["failurePolicy"] == "Fail"
+        assert webhook["timeoutSeconds"] == 5
+        assert webhook["sideEffects"] == "None"
+        assert "namespaceSelector" not in webhook
+
+
+@pytest.mark.parametrize(
+    "config, message",
+    [
+        (
+            {"webhook-timeout": 60},
+            "Invalid webhook-timeout: timeout must be 1-30 seconds",
+        ),
+        (
+            {"webhook-failure-policy": "Retry"},
+            "Invalid webhook-failure-policy: failure policy must be Fail or Ignore",
+        ),
+        (
+            {"webhook-overrides": "{unknown: {failurePolicy: Ignore}}"},
+            "Invalid webhook-overrides: unknown webhook unknown",
+        ),
+    ],
+)
+def test_invalid_webhook_scope(harness, config, message):
+    harness.update_config(config)
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(message)
+
+
+def isvc_crd(harness):
+    _, resources = harness.get_pod_spec()
+    crds = resources["kubernetesResources"]["customResourceDefinitions"]
+    return next(crd for crd in crds if crd["name"].startswith("inferenceservices"))
+
+
+def test_served_api_versions(harness):
+    harness.set_model_name("kubeflow-serving")
+    harness.begin_with_initial_hooks()
+    spec = isvc_crd(harness)["spec"]
+    assert spec["conversion"]["webhookClientConfig"]["service"]["namespace"] == (
+        "kubeflow-serving"
+    )
+    assert len(webhooks(harness)) == 6
+
+    harness.update_config({"served-api-versions": "v1beta1"})
+    spec = isvc_crd(harness)["spec"]
+    assert spec["conversion"] == {"strategy": "None"}
+    assert spec["version"] == "v1beta1"
+    assert [(v["name"], v["served"], v["storage"]) for v in spec["versions"]] == [
+        ("v1beta1", True, True),
+        ("v1alpha2", False, False),
+    ]
+    assert set(webhooks(harness)) == {
+        "inferenceservice.kfserving-webhook-server.v1beta1.defaulter",
+        "inferenceservice.kfserving-webhook-server.pod-mutator",
+        "inferenceservice.kfserving-webhook-server.v1beta1.validator",
+        "trainedmodel.kfserving-webhook-server.validator",
+    }
+
+
+@pytest.mark.parametrize(
+    "versions, message",
+    [
+        ("v1", "must be a subset of v1alpha2,v1beta1"),
+        ("v1alpha2", "only the storage version v1beta1 can be served alone"),
+    ],
+)
+def test_invalid_served_api_versions(harness, versions, message):
+    harness.update_config({"served-api-versions": versions})
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        f"Invalid served-api-versions: {message}"
+    )
+
+
+def test_prepull(harness, lightkube_client):
+    harness.update_config(
+        {"prepull-runtimes": "sklearn,triton", "prepull-node-selector": "gpu=true"}
+    )
+    harness.begin_with_initial_hooks()
+
+    assert harness.charm.model.unit.status == ActiveStatus()
+    daemonset = applied(lightkube_client, "DaemonSet")
+    assert daemonset.metadata.name == "kfserving-prepull"
+    pod = daemonset.spec.template.spec
+    assert pod.nodeSelector == {"gpu": "true"}
+    assert [c.image for c in pod.initContainers] == [
+        "busybox:1.33.1-musl",
+        "docker.io/seldonio/mlserver:0.2.1",
+        "gcr.io/kfserving/sklearnserver:v0.5.1",
+        "gcr.io/kfserving/storage-initializer:v0.5.1",
+        "kfserving/agent:v0.5.1",
+        "nvcr.io/nvidia/tritonserver:20.08-py3",
+    ]
+
+    lightkube_client.create.reset_mock()
+    harness.charm.on.config_changed.emit()
+    lightkube_client.create.assert_not_called()
+
+    harness.update_config({"prepull-runtimes": ""})
+    lightkube_client.delete.assert_called_once()
+
+
+def test_prepull_unknown_runtime(harness):
+    harness.update_config({"prepull-runtimes": "caffe"})
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        "Invalid prepull-runtimes: unknown runtime caffe"
+    )
+
+
+def isvc_config(lightkube_client):
+    config_map = applied(lightkube_client, "ConfigMap").data
+    return {key: json.loads(value) for key, value in config_map.items()}
+
+
+def test_sidecar_resources(harness, lightkube_client):
+    harness.update_config(
+        {
+            "sidecar-profile": "small",
+            "sidecar-resources": "{batcher: {cpuRequest: 200m, cpuLimit: 1}}",
+        }
+    )
+    harness.begin_with_initial_hooks()
+
+    config = isvc_config(lightkube_client)
+    assert config["agent"]["cpuRequest"] == "50m"
+    assert config["logger"]["memoryLimit"] == "256Mi"
+    assert config["batcher"]["cpuRequest"] == "200m"
+    assert config["batcher"]["cpuLimit"] == "1"
+    assert config["batcher"]["memoryRequest"] == "64Mi"
+    assert config["storageInitializer"]["image"] == (
+        "gcr.io/kfserving/storage-initializer:v0.5.1"
+    )
+
+
+@pytest.mark.parametrize(
+    "config, message",
+    [
+        (
+            {"sidecar-profile": "tiny"},
+            "Invalid sidecar-profile: must be one of small, standard, large",
+        ),
+        (
+            {"sidecar-resources": "{explainer: {cpuRequest: 1}}"},
+            "Invalid sidecar-resources: unknown sidecar explainer",
+        ),
+        (
+            {"sidecar-resources": "{agent: {cpuRequest: 2}}"},
+            "Invalid sidecar-resources: agent cpuRequest exceeds cpuLimit",
+        ),
+    ],
+)
+def test_invalid_sidecar_resources(harness, config, message):
+    harness.update_config(config)
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(message)
+
+
+def test_multi_model_serving(harness, lightkube_client):
+    harness.update_config({"multi-model-runtimes": "sklearn/v2,triton"})
+    harness.begin_with_initial_hooks()
+
+    config = isvc_config(lightkube_client)
+    predictors = config["predictors"]
+    assert predictors["sklearn"]["v2"]["multiModelServer"] is True
+    assert predictors["triton"]["multiModelServer"] is True
+    assert predictors["sklearn"]["v1"]["multiModelServer"] is False
+    assert predictors["tensorflow"]["multiModelServer"] is False
+    assert "puller" not in config["agent"]
+
+
+def test_multi_model_serving_unsupported(harness):
+    harness.update_config({"multi-model-runtimes": "pytorch"})
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        "Invalid multi-model-runtimes: pytorch does not support multi-model serving"
+    )
+
+
+def test_config_overlay(harness, lightkube_client):
+    overlay = """
+        ingress: {ingressGateway: custom-gateway.istio-system}
+        agent: {memoryLimit: 2Gi}
+        predictors:
+          sklearn: {v2: {defaultImageVersion: 0.3.0}}
+          custom: {image: registry.local/custom, defaultImageVersion: v1}
+    """
+    harness.update_config({"sidecar-profile": "small", "config-overlay": overlay})
+    harness.begin_with_initial_hooks()
+
+    config = isvc_config(lightkube_client)
+    assert config["ingress"]["ingressGateway"] == "custom-gateway.istio-system"
+    assert config["agent"]["memoryLimit"] == "2Gi"
+    assert config["agent"]["cpuLimit"] == "500m"
+    assert config["predictors"]["sklearn"]["v2"]["defaultImageVersion"] == "0.3.0"
+    assert config["predictors"]["sklearn"]["v1"]["defaultImageVersion"] == "v0.5.1"
+    assert config["predictors"]["custom"]["image"] == "registry.local/custom"
+
+    # Restating a value of the merged result does not republish it
+    harness.model.pod.set_spec = MagicMock()
+    overlay += "logger: {cpuLimit: 500m}"
+    harness.update_config({"config-overlay": overlay})
+    harness.model.pod.set_spec.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "overlay, message",
+    [
+        ("{gateway: {}}", "unknown key gateway"),
+        ("{ingress: gateway}", "ingress must be a mapping"),
+        ("{agent: {cpuLimit: 2}}", "agent.cpuLimit must be a str"),
+        ("{ingress: {ingressGatway: gw.ns}}", "unknown key ingress.ingressGatway"),
+        ("{agent: {cpuLimit: lots}}", "agent cpuLimit lots"),
+        ("{agent: {cpuRequest: '2'}}", "agent cpuRequest exceeds cpuLimit"),
+        ("{ingress: {localGateway: local}}", "ingress.localGateway local"),
+        (
+            "{predictors: {custom: 5}}",
+            "predictors.custom needs an image and defaultImageVersion",
+        ),
+        (
+            "{predictors: {custom: {v1: 5}}}",
+            "predictors.custom needs an image and defaultImageVersion",
+        ),
+        (
+            "{predictors: {sklearn: {v3: {image: reg/sklearn}}}}",
+            "predictors.sklearn.v3 needs an image and defaultImageVersion",
+        ),
+        (
+            "{explainers: {custom: {defaultImageVersion: v1}}}",
+            "explainers.custom needs an image and defaultImageVersion",
+        ),
+        (
+            "{predictors: {custom: {image: reg/custom, defaultImageVersion: 1}}}",
+            "predictors.custom.defaultImageVersion must be a str",
+        ),
+    ],
+)
+def test_invalid_config_overlay(harness, overlay, message):
+    harness.update_config({"config-overlay": overlay})
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        f"Invalid config-overlay: {message}"
+    )
+
+
+def test_prepull_added_runtime_without_version(harness):
+    harness.update_config(
+        {
+            "config-overlay": "{predictors: {custom: {image: reg/custom}}}",
+            "prepull-runtimes": "custom",
+        }
+    )
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        "Invalid config-overlay: predictors.custom needs an image and "
+        "defaultImageVersion"
+    )
+
+
+DIGEST = "sha256:" + "0" * 64
+
+
+def test_image_rewrites(harness, lightkube_client):
+    harness.update_config(
+        {
+            "prepull-runtimes": "sklearn/v1",
+            "image-registry-mirror": "registry.local:5000/",
+            "image-digests": f"""
+                kfserving/agent:v0.5.1: {DIGEST}
+                gcr.io/kfserving/sklearnserver:v0.5.1: {DIGEST}
+            """,
+        }
+    )
+    harness.begin_with_initial_hooks()
+
+    config = isvc_config(lightkube_client)
+    sklearn = config["predictors"]["sklearn"]["v1"]
+    assert sklearn["image"] == "registry.local:5000/kfserving/sklearnserver"
+    assert sklearn["defaultImageVersion"] == f"v0.5.1@{DIGEST}"
+    assert (
+        config["agent"]["image"]
+        == f"registry.local:5000/kfserving/agent:v0.5.1@{DIGEST}"
+    )
+    assert config["storageInitializer"]["image"] == (
+        "registry.local:5000/kfserving/storage-initializer:v0.5.1"
+    )
+    assert config["explainers"]["alibi"]["image"] == (
+        "registry.local:5000/kfserving/alibi-explainer"
+    )
+
+    daemonset = applied(lightkube_client, "DaemonSet")
+    assert [c.image for c in daemonset.spec.template.spec.initContainers] == [
+        "registry.local:5000/library/busybox:1.33.1-musl",
+        f"registry.local:5000/kfserving/agent:v0.5.1@{DIGEST}",
+        f"registry.local:5000/kfserving/sklearnserver:v0.5.1@{DIGEST}",
+        "registry.local:5000/kfserving/storage-initializer:v0.5.1",
+    ]
+
+    event = MagicMock()
+    harness.charm.image_rewrites(event)
+    results = event.set_results.call_args[0][0]
+    assert (
+        f"kfserving/agent:v0.5.1 -> registry.local:5000/kfserving/agent:v0.5.1@{DIGEST}"
+        in (results["images"].splitlines())
+    )
+
+
+@pytest.mark.parametrize(
+    "option, value, message",
+    [
+        ("image-registry-mirror", "https://mirror", "Invalid image-registry-mirror"),
+        ("image-digests", f"{{busybox: {DIGEST}}}", "unknown image busybox"),
+        ("image-digests", "{kfserving/agent:v0.5.1: latest}", "digest latest"),
+    ],
+)
+def test_invalid_image_rewrites(harness, option, value, message):
+    harness.update_config({option: value})
+    harness.begin_with_initial_hooks()
+    assert isinstance(harness.charm.model.unit.status, BlockedStatus)
+    assert message in harness.charm.model.unit.status.message
+
+
+def test_ingress_gateways(harness, lightkube_client):
+    relation_id = harness.add_relation("kfserving", "client")
+    harness.update_config(
+        {
+            "ingress-gateway": "public-gateway.istio-system",
+            "local-gateway-service": "local-gateway.istio-system.svc.cluster.local",
+        }
+    )
+    harness.begin_with_initial_hooks()
+
+    ingress = isvc_config(lightkube_client)["ingress"]
+    assert ingress["ingressGateway"] == "public-gateway.istio-system"
+    assert ingress["localGateway"] == "cluster-local-gateway.knative-serving"
+    data = harness.get_relation_data(relation_id, "kfserving")
+    assert data["ingress-gateway"] == "public-gateway.istio-system"
+    assert data["endpoint"] == "istio-ingressgateway.istio-system.svc.cluster.local"
+
+    harness.update_config({"prefer-local-gateway": True})
+    data = harness.get_relation_data(relation_id, "kfserving")
+    assert data["endpoint"] == "local-gateway.istio-system.svc.cluster.local"
+
+
+def test_invalid_ingress_gateway(harness):
+    harness.update_config({"ingress-gateway": "kubeflow-gateway"})
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        "Invalid ingress-gateway: kubeflow-gateway"
+    )
+
+
+def test_logger_url(harness, lightkube_client):
+    harness.begin_with_initial_hooks()
+    logger = isvc_config(lightkube_client)["logger"]
+    assert logger["defaultUrl"] == "http://default-broker"
+
+    harness.update_config({"logger-url": "http://logs.observability.svc"})
+    logger = isvc_config(lightkube_client)["logger"]
+    assert logger["defaultUrl"] == "http://logs.observability.svc"
+    assert set(logger) == {
+        "image",
+        "memoryRequest",
+        "memoryLimit",
+        "cpuRequest",
+        "cpuLimit",
+        "defaultUrl",
+    }
+
+
+def test_invalid_logger_url(harness):
+    harness.update_config({"logger-url": "default-broker"})
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == BlockedStatus(
+        "Invalid logger-url: default-broker"
+    )
+
+
+def test_probes(harness):
+    harness.begin_with_initial_hooks()
+    probes = manager(harness)["kubernetes"]
+    assert probes["startupProbe"]["tcpSocket"] == {"port": 9443}
+    assert probes["readinessProbe"]["tcpSocket"] == {"port": 9443}
+    assert probes["livenessProbe"]["httpGet"] == {"path": "/metrics", "port": 8080}
+
+    harness.update_config({"metrics-bind-address": "127.0.0.1"})
+    probes = manager(harness)["kubernetes"]
+    assert probes["livenessProbe"]["tcpSocket"] == {"port": 9443}
+
+
+def progressing(completed):
+    """Returns the Progressing condition of a rollout ``completed`` at a timestamp."""
+
+    return {
+        "type": "Progressing",
+        "status": "True",
+        "reason": "NewReplicaSetAvailable",
+        "lastUpdateTime": datetime.utcfromtimestamp(completed).isoformat() + "Z",
+    }
+
+
+def test_waits_for_webhook_server(harness, lightkube_client, webhook_ready):
+    webhook_ready.return_value = False
+    harness.begin_with_initial_hooks()
+    assert harness.charm.model.unit.status == MaintenanceStatus(
+        "Waiting for webhook server"
+    )
+
+    # Timestamps of the API server are whole seconds
+    started = harness.charm._stored.rollout_started
+    deployment = lightkube_client.get.return_value.to_dict()
+    deployment["status"]["conditions"] = [progressing(math.ceil(started) + 30)]
+    lightkube_client.get.return_value = codecs.from_dict(deployment)
+    webhook_ready.return_value = True
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == ActiveStatus()
+    host, port, ca = webhook_ready.call_args[0]
+    assert host.startswith("kfserving-webhook-server-service.")
+    assert ca == harness.charm._stored.ca
+
+    event = MagicMock()
+    harness.charm.rollout_times(event)
+    results = event.set_results.call_args[0][0]
+    assert results["count"] == 1
+    assert 30 <= results["last"] < 31
+
+    # Reconfiguring without a pod spec change is not a rollout
+    harness.charm.on.config_changed.emit()
+    assert (
+        json.loads(harness.charm._stored.rollouts)
+        == json.loads(harness.charm._stored.rollouts)[:1]
+    )
+
+
+@pytest.mark.parametrize(
+    "invalid, valid, message",
+    [
+        (
+            {"webhook-timeout": 60},
+            {"webhook-timeout": 10},
+            "Invalid webhook-timeout: timeout must be 1-30 seconds",
+        ),
+        ({"gomaxprocs": -1}, {"gomaxprocs": 0}, "Invalid gomaxprocs: -1"),
+    ],
+)
+def test_update_status_keeps_blocked(harness, invalid, valid, message):
+    harness.begin_with_initial_hooks()
+    harness.update_config(invalid)
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == BlockedStatus(message)
+
+    harness.update_config(valid)
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == ActiveStatus()
+
+
+def test_update_status_keeps_missing_image(make_harness):
+    harness = make_harness(image_details=None)
+    harness.begin_with_initial_hooks()
+    status = harness.charm.model.unit.status
+    assert status.name == "blocked"
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == status
+
+
+def test_waits_for_manager_rollout(harness, lightkube_client, webhook_ready):
+    rolled_out = lightkube_client.get.return_value
+    harness.begin_with_initial_hooks()
+    harness.charm.on.update_status.emit()
+    rollouts = json.loads(harness.charm._stored.rollouts)
+
+    # The old pod still answers while the new one is not ready
+    harness.update_config({"webhook-port": "8443"})
+    assert harness.charm.model.unit.status == MaintenanceStatus("Setting pod spec")
+    rolling = rolled_out.to_dict()
+    rolling["metadata"]["generation"] = 2
+    rolling["status"].update({"observedGeneration": 2, "replicas": 2})
+    lightkube_client.get.return_value = codecs.from_dict(rolling)
+    webhook_ready.reset_mock()
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == MaintenanceStatus(
+        "Waiting for manager rollout"
+    )
+    webhook_ready.assert_not_called()
+    assert json.loads(harness.charm._stored.rollouts) == rollouts
+
+    # Nor is the rollout observed before the Deployment controller saw it
+    rolling["status"].update({"observedGeneration": 1, "replicas": 1})
+    lightkube_client.get.return_value = codecs.from_dict(rolling)
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == MaintenanceStatus(
+        "Waiting for manager rollout"
+    )
+
+    # However late update-status runs, the rollout took as long as the
+    # Deployment controller saw it take
+    started = harness.charm._stored.rollout_started
+    rolling["status"].update({"observedGeneration": 2})
+    rolling["status"]["conditions"] = [progressing(math.ceil(started) + 12)]
+    lightkube_client.get.return_value = codecs.from_dict(rolling)
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == ActiveStatus()
+    webhook_ready.assert_called_once()
+    rollout = json.loads(harness.charm._stored.rollouts)[-1]
+    assert rollout["started"] == started
+    assert 12 <= rollout["seconds"] < 13
+    assert harness.charm._stored.rollout_started is None
+
+
+def test_spec_change_without_rollout(harness, lightkube_client):
+    harness.begin_with_initial_hooks()
+    rollouts = json.loads(harness.charm._stored.rollouts)
+    harness.update_config({"webhook-port": "8443"})
+
+    # The pods were last rolled out before the change
+    deployment = lightkube_client.get.return_value.to_dict()
+    started = harness.charm._stored.rollout_started
+    deployment["status"]["conditions"] = [progressing(math.floor(started) - 60)]
+    lightkube_client.get.return_value = codecs.from_dict(deployment)
+
+    harness.charm.on.update_status.emit()
+    assert harness.charm.model.unit.status == ActiveStatus()
+    assert json.loads(harness.charm._stored.rollouts) == rollouts
+    assert harness.charm._stored.rollout_started is None
@@ -0,0 +1,50 @@
+from crds import load_crds, strip_descriptions
+
+
+def test_bundle_matches_yaml(tmp_path):
+    assert load_crds() == load_crds(bundle=tmp_path / "missing.json")
+
+
+def test_strip_descriptions():
+    schema = {
+        "description": "An InferenceService",
+        "type": "object",
+        "properties": {
+            "description": {
+                "description": "A field named description",
+                "type": "string",
+            },
+            "env": {
+                "type": "array",
+                "items": {"description": "A variable", "type": "object"},
+            },
+            "limits": {
+                "additionalProperties": {
+                    "anyOf": [{"type": "integer", "example": 1}, {"type": "string"}],
+                    "x-kubernetes-int-or-string": True,
+                },
+            },
+        },
+        "required": ["description"],
+    }
+    crd = {
+        "name": "examples.serving.kubeflow.org",
+        "spec": {"versions": [{"name": "v1", "schema": {"openAPIV3Schema": schema}}]},
+    }
+
+    strip_descriptions(crd)
+
+    assert schema == {
+        "type": "object",
+        "properties": {
+            "description": {"type": "string"},
+            "env": {"type": "array", "items": {"type": "object"}},
+            "limits": {
+                "additionalProperties": {
+                    "anyOf": [{"type": "integer"}, {"type": "string"}],
+                    "x-kubernetes-int-or-string": True,
+                },
+            },
+        },
+        "required": ["description"],
+    }
@@ -0,0 +1,124 @@
+"""Offline benchmarks of the Operator hooks.
+
+Every scenario simulates one or more Juju dispatches against a fresh charm
+instance and is measured for wall time, subprocesses spawned and peak Python
+memory. ``baselines.json`` records the measurements of every scenario, and a
+scenario fails when any measurement exceeds its baseline by more than its
+tolerance: wall time varies between runners, memory barely and subprocesses not
+at all. When a change legitimately makes a hook slower or bigger, record the
+measurements printed by ``pytest -s`` as the new baseline in the same commit.
+"""
+
+import json
+import subprocess
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import pytest
+
+BASELINES = json.loads((Path(__file__).parent / "baselines.json").read_text())
+NOOP_HOOKS = 20
+# Factors the measurements may exceed their baseline by
+TOLERANCE = {"seconds": 3.0, "subprocesses": 1.0, "peak_memory_mb": 1.25}
+
+
+def install(make_harness):
+    harness = make_harness()
+    harness.begin()
+    harness.charm.on.install.emit()
+
+
+def leader_elected(make_harness):
+    harness = make_harness()
+    harness.begin()
+    harness.charm.on.leader_elected.emit()
+
+
+def config_changed(make_harness):
+    harness = make_harness()
+    harness.begin()
+    harness.charm.on.config_changed.emit()
+
+
+def upgrade_charm(make_harness):
+    harness = make_harness()
+    harness.begin()
+    harness.charm.on.upgrade_charm.emit()
+
+
+def deploy(make_harness):
+    harness = make_harness()
+    harness.begin_with_initial_hooks()
+
+
+def noop_hooks(make_harness):
+    harness = make_harness()
+    harness.begin()
+    harness.charm.on.install.emit()
+    for _ in range(NOOP_HOOKS):
+        harness.charm.on.config_changed.emit()
+
+
+SCENARIOS = {
+    "install": install,
+    "leader-elected": leader_elected,
+    "config-changed": config_changed,
+    "upgrade-charm": upgrade_charm,
+    "deploy": deploy,
+    "noop-hooks": noop_hooks,
+}
+
+
+@pytest.fixture
+def subprocesses(monkeypatch):
+    """Counts the subprocesses spawned while the test runs."""
+
+    spawned = []
+    execute_child = subprocess.Popen._execute_child
+
+    def counting_execute_child(self, args, *rest, **kwargs):
+        spawned.append(args)
+        return execute_child(self, args, *rest, **kwargs)
+
+    monkeypatch.setattr(subprocess.Popen, "_execute_child", counting_execute_child)
+    return spawned
+
+
+def measure(scenario, make_harness, subprocesses, rounds=3):
+    """Returns the best wall time, subprocess count and peak memory of scenario."""
+
+    seconds = []
+    for _ in range(rounds):
+        start = perf_counter()
+        scenario(make_harness)
+        seconds.append(perf_counter() - start)
+
+    # Measured separately, as tracing allocations slows everything down
+    del subprocesses[:]
+    tracemalloc.start()
+    try:
+        scenario(make_harness)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": min(seconds),
+        "subprocesses": len(subprocesses),
+        "peak_memory_mb": peak / 2**20,
+    }
+
+
+@pytest.mark.parametrize("name", SCENARIOS)
+def test_hook_performance(name, make_harness, subprocesses):
+    result = measure(SCENARIOS[name], make_harness, subprocesses)
+    baseline = BASELINES[name]
+
+    print(f"{name}: {json.dumps(result)}")
+    exceeded = {
+        key: f"{result[key]:.3f} > {value} * {TOLERANCE[key]}"
+        for key, value in baseline.items()
+        if result[key] > value * TOLERANCE[key]
+    }
+    assert not exceeded, f"{name} exceeded its baselines: {exceeded}"
@@ -0,0 +1,53 @@
+from time import sleep
+from unittest.mock import MagicMock
+
+from timing import HookTimer, payload_size
+
+
+def test_payload_size():
+    assert payload_size(b"abc") == 3
+    assert payload_size("é") == 2
+    assert payload_size({"a": [1, 2]}) == len('{"a":[1,2]}')
+
+
+def test_report():
+    timer = HookTimer()
+    with timer.span("first") as span:
+        span.measure({"key": "value"})
+    with timer.span("second"):
+        pass
+
+    report = timer.report("install")
+    assert report["hook"] == "install"
+    assert [span["name"] for span in report["spans"]] == ["first", "second"]
+    assert report["spans"][0]["bytes"] == payload_size({"key": "value"})
+    assert "bytes" not in report["spans"][1]
+    assert report["seconds"] >= sum(span["seconds"] for span in report["spans"])
+
+    with timer.span("outer"):
+        with timer.span("inner"):
+            sleep(0.01)
+    report = timer.report("install")
+    outer, inner = report["spans"][1]["seconds"], report["spans"][0]["seconds"]
+    # Nested spans are part of the total once, not added up
+    assert outer <= report["seconds"] < outer + inner
+
+    # Spans are reported once, so that every hook starts afresh
+    assert timer.report("config_changed")["spans"] == []
+
+
+def test_hook_timings_action(harness):
+    harness.begin()
+    event = MagicMock()
+    harness.charm.hook_timings(event)
+    event.fail.assert_called_once_with("No hook timings recorded yet")
+
+    harness.charm.on.install.emit()
+    event = MagicMock()
+    harness.charm.hook_timings(event)
+    results = event.set_results.call_args[0][0]
+    assert results["hook"] == "install"
+    assert results["seconds"] > 0
+    assert results["spans.set-spec.seconds"] > 0
+    assert results["spans.set-spec.bytes"] > 0
+    assert results["spans.crds.bytes"] > 0